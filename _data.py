@@ -1,6 +1,8 @@
 import os     as _os
 import shutil as _shutil
 import _dialogs
+import _fused
+import _derivatives
 
 # do this so all the scripts will work with all the numpy functions
 import numpy          as _n
@@ -9,6 +11,26 @@ import pylab          as _p
 import textwrap       as _textwrap
 import spinmob        as _s
 import time           as _time
+import re             as _re
+import json           as _json
+import itertools      as _itertools
+import ast            as _ast
+import multiprocessing as _multiprocessing
+import hashlib        as _hashlib
+import UserDict       as _UserDict
+import cPickle        as _pickle
+import gzip           as _gzip
+import bz2            as _bz2
+
+# lzma (for .xz files) is only in python 2 via the backports.lzma package
+try:    import lzma as _lzma
+except ImportError:
+    try:    from backports import lzma as _lzma
+    except: _lzma = None
+
+# h5py is only needed for save_h5() and load_h5()
+try:    import h5py as _h5py
+except ImportError: _h5py = None
 
 
 
@@ -20,6 +42,863 @@ import time           as _time
 
 
 
+#############################################################
+# Contiguous storage for databox columns
+#############################################################
+
+class _column_block:
+
+    def __init__(self, length, dtype=float, capacity=4):
+        """
+        Preallocated 2-D array holding equal-length columns of the same dtype
+        as its rows. This lets a databox hand out zero-copy column views, and
+        trim / copy all of its columns with a single numpy operation.
+
+        length      number of data points in each column
+        dtype       numpy dtype shared by all the columns
+        capacity    number of columns to preallocate
+
+        Each row has room for more than length data points once append()
+        has been used; the views only cover the filled region.
+
+        Rows of replaced or removed columns are retired rather than reused,
+        since somebody may still hold the old view. They're freed when the
+        block is next reallocated.
+        """
+        self.length   = length
+        self.dtype    = _n.dtype(dtype)
+        self.data     = _n.empty((max(capacity,1), length), self.dtype)
+        self.rows     = {}   # ckey -> row index in self.data
+        self.views    = {}   # ckey -> the view we handed out
+        self._free    = range(len(self.data))
+        self._retired = []   # rows old views may still be looking at
+
+    def accepts(self, a):
+        """
+        Returns True if the array a can live in this block.
+        """
+        return a.ndim == 1 and len(a) == self.length and a.dtype == self.dtype
+
+    def set(self, ckey, a):
+        """
+        Copies the array a into a fresh row for ckey (unless a is already
+        ckey's view), so views of the old data handed out earlier don't
+        change. Returns True if the block had to be reallocated, meaning all
+        previously handed-out views are stale.
+        """
+        if ckey in self.rows:
+            if a is self.views[ckey]: return False
+            self.remove(ckey)
+
+        grew = False
+        if len(self._free) == 0:
+
+            # new home for the live rows, doubling the capacity only if
+            # there aren't enough retired rows to reuse
+            keys = self.rows.keys()
+            data = _n.empty((max(2*len(keys), 4), self.data.shape[1]), self.dtype)
+            for n in range(len(keys)): data[n] = self.data[self.rows[keys[n]]]
+            self.rows     = dict([(keys[n], n) for n in range(len(keys))])
+            self._free    = range(len(keys), len(data))
+            self._retired = []
+            self.data     = data
+            for k in self.rows: self.views[k] = self.data[self.rows[k], 0:self.length]
+            grew = True
+
+        self.rows[ckey]  = self._free.pop(0)
+        self.views[ckey] = self.data[self.rows[ckey], 0:self.length]
+        self.views[ckey][:] = a
+        return grew
+
+    def append(self, ckeys, values):
+        """
+        Appends values[n] to the row for ckeys[n], doubling the room in each
+        row when it's full, so appending is amortized O(1). The ckeys must be
+        all of the block's columns. Returns False (and does nothing) if the
+        values don't fit the block's dtype.
+        """
+        values = _n.asarray(values)
+        if not values.ndim == 1 or not _n.promote_types(self.dtype, values.dtype) == self.dtype: return False
+
+        # double the room if we're full
+        if self.length == self.data.shape[1]:
+            data = _n.empty((len(self.data), max(2*self.length, 16)), self.dtype)
+            data[:, 0:self.length] = self.data
+            self.data = data
+
+            # nobody has views of the new array's retired rows
+            self._free   += self._retired
+            self._retired = []
+
+        # write the new point and extend the views over it
+        self.data[[self.rows[k] for k in ckeys], self.length] = values
+        self.length += 1
+        for k in self.rows: self.views[k] = self.data[self.rows[k], 0:self.length]
+        return True
+
+    def remove(self, ckey):
+        """
+        Retires the row used by ckey (if any). It's only reused once the
+        block has been reallocated.
+        """
+        if ckey in self.rows:
+            self._retired.append(self.rows.pop(ckey))
+            self.views.pop(ckey)
+
+    def rename(self, old, new):
+        """
+        Renames the row key.
+        """
+        if old in self.rows:
+            self.rows [new] = self.rows .pop(old)
+            self.views[new] = self.views.pop(old)
+
+    def take(self, ckeys, ns):
+        """
+        Returns a new block containing only the data points with indices
+        ns for the supplied ckeys, using a single fancy-indexing copy.
+        """
+        rows  = [self.rows[k] for k in ckeys]
+        block = _column_block(len(ns), self.dtype, len(ckeys))
+        block.data[0:len(rows)] = self.data[_n.ix_(rows, ns)]
+        for n in range(len(ckeys)):
+            block.rows [ckeys[n]] = n
+            block.views[ckeys[n]] = block.data[n]
+        block._free = range(len(ckeys), len(block.data))
+        return block
+
+
+
+
+#############################################################
+# Parsing ascii data
+#############################################################
+
+# a number immediately followed by i or j (e.g. "1.5+2i" or "3e-2j")
+_complex_token = _re.compile(r'[0-9.][ijJ]')
+
+# a plain real number like "-1.5e-3" (optionally surrounded by white space)
+_number_token = _re.compile(r'\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$')
+
+def _elements_are_numbers(elements):
+    """
+    Quick version of spinmob.fun.elements_are_numbers() for scanning headers.
+    Plain real numbers are matched with a precompiled regular expression, and
+    only other elements (complex, nan, ...) go through spinmob.fun.is_a_number().
+    """
+    if len(elements) == 0: return False
+    for x in elements:
+        if not _number_token.match(x) and not _s.fun.is_a_number(x): return False
+    return True
+
+# names allowed in header values, and the cache of decoded (immutable) values
+_header_names = {'True':True, 'False':False, 'None':None, 'nan':_n.nan, 'inf':_n.inf}
+_header_cache = {}
+_header_cache_size = 10000
+
+def _decode_literal(text):
+    """
+    Decodes the repr() of a header value (numbers, strings, booleans, None,
+    nan, inf, lists, tuples, dictionaries and numpy's "array([...], dtype=...)")
+    without eval(). Raises ValueError for anything else.
+
+    Immutable results are cached by text, so repeated values are just a lookup.
+    """
+    try:    return _header_cache[text]
+    except: pass
+
+    try:    node = _ast.parse(text.strip(), mode='eval').body
+    except: raise ValueError(text)
+
+    value = _decode_node(node)
+
+    # only cache values nobody can modify
+    if type(value) in [int, long, float, complex, str, unicode, bool, type(None)]:
+        if len(_header_cache) >= _header_cache_size: _header_cache.clear()
+        _header_cache[text] = value
+
+    return value
+
+def _decode_node(node):
+    """
+    Returns the value of the literal ast node (see _decode_literal()).
+    """
+    if isinstance(node, _ast.Num):   return node.n
+    if isinstance(node, _ast.Str):   return node.s
+    if isinstance(node, _ast.Tuple): return tuple([_decode_node(x) for x in node.elts])
+    if isinstance(node, _ast.List):  return [_decode_node(x) for x in node.elts]
+    if isinstance(node, _ast.Dict):
+        return dict(zip([_decode_node(x) for x in node.keys], [_decode_node(x) for x in node.values]))
+
+    if isinstance(node, _ast.Name) and node.id in _header_names: return _header_names[node.id]
+
+    # signs, and complex numbers like "(1+2j)"
+    if isinstance(node, _ast.UnaryOp) and type(node.op) in [_ast.USub, _ast.UAdd]:
+        x = _decode_node(node.operand)
+        if type(x) in [int, long, float, complex]: return -x if isinstance(node.op, _ast.USub) else x
+    if isinstance(node, _ast.BinOp) and type(node.op) in [_ast.Add, _ast.Sub]:
+        a = _decode_node(node.left)
+        b = _decode_node(node.right)
+        if type(a) in [int, long, float] and type(b) is complex:
+            return a+b if isinstance(node.op, _ast.Add) else a-b
+
+    # numpy arrays
+    if isinstance(node, _ast.Call) and isinstance(node.func, _ast.Name) and node.func.id == 'array' \
+       and len(node.args) == 1 and node.starargs is None and node.kwargs is None:
+        kwargs = dict()
+        for k in node.keywords:
+            if not k.arg == 'dtype': raise ValueError(k.arg)
+            if isinstance(k.value, _ast.Name): kwargs['dtype'] = _n.dtype(k.value.id)
+            else:                              kwargs['dtype'] = _n.dtype(_decode_node(k.value))
+        return _n.array(_decode_node(node.args[0]), **kwargs)
+
+    raise ValueError(_ast.dump(node))
+
+# compressed file extensions and the default compression level for each
+_compression_levels = {'.gz':6, '.bz2':9, '.xz':6}
+
+def _compression(path):
+    """
+    Returns the compression extension ('.gz', '.bz2' or '.xz') of path, or None.
+    """
+    extension = _os.path.splitext(str(path))[1].lower()
+    if extension in _compression_levels: return extension
+    return None
+
+def _open(path, mode='r', compression='auto', level=None):
+    """
+    Opens path like open(), but .gz, .bz2 and .xz files are (de)compressed
+    on the fly while streaming, with no temporary file.
+
+    mode            'r' (universal newlines for plain files) or 'w'
+    compression     'auto' means look at the extension of path; otherwise
+                    one of '.gz', '.bz2', '.xz' or None
+    level           compression level for writing (None means the default)
+    """
+    if compression == 'auto': compression = _compression(path)
+    if compression is None: return open(path, 'rU' if mode == 'r' else mode)
+
+    if level is None: level = _compression_levels[compression]
+
+    if compression == '.gz':
+        if mode == 'r': return _gzip.GzipFile(path, 'rb')
+        else:           return _gzip.GzipFile(path, 'wb', level)
+
+    if compression == '.bz2':
+        if mode == 'r': return _bz2.BZ2File(path, 'r')
+        else:           return _bz2.BZ2File(path, 'w', compresslevel=level)
+
+    if _lzma is None: raise IOError("Reading or writing .xz files needs the lzma module (pip install backports.lzma).")
+    if mode == 'r': return _lzma.LZMAFile(path, 'r')
+    else:           return _lzma.LZMAFile(path, 'w', preset=level)
+
+def _sniff_delimiter(f, size=4096):
+    """
+    Guesses the delimiter (None for white space, ',' or ';') of the open file
+    f from its last non-empty line, reading only the end of the file. Leaves
+    f at the beginning.
+
+    Compressed files can't seek to the end, so for those we use the last
+    line of (roughly) the first 64 kB instead.
+    """
+    compressed = not isinstance(f, file)
+
+    if compressed: end = 0
+    else:
+        f.seek(0,2)
+        end = f.tell()
+
+    while True:
+        if compressed:
+            start = 0
+            f.seek(0)
+            lines = (f.read(65536) + f.readline()).splitlines()
+        else:
+            start = max(0, end-size)
+            f.seek(start)
+            lines = f.read().splitlines()
+
+        # the first line is probably only part of a line
+        if start > 0: lines = lines[1:]
+
+        # loop from the end of the file until we get something other than white space
+        for line in reversed(lines):
+            s = line.strip()
+            if len(s) == 0: continue
+
+            # try the different delimiter schemes until we find one
+            # that produces a number. Otherwise it's ambiguous.
+            f.seek(0)
+            if   _s.fun.is_a_number(s.split(None)[0]): return None
+            elif _s.fun.is_a_number(s.split(',') [0]): return ','
+            elif _s.fun.is_a_number(s.split(';') [0]): return ';'
+            return None
+
+        # nothing but white space; look further back
+        if start == 0: break
+        size = size*4
+
+    f.seek(0)
+    return None
+
+# first line of files written by databox.save_binary()
+_binary_magic = '\x93SPINMOB BINARY 1\n'
+
+def _is_binary_file(path):
+    """
+    Returns True if the file starts with the databox binary magic string.
+    """
+    f = open(path, 'rb')
+    magic = f.read(len(_binary_magic))
+    f.close()
+    return magic == _binary_magic
+
+def _binary_padded(n, alignment=64):
+    """
+    Returns n rounded up to the next multiple of alignment.
+    """
+    return -(-n//alignment)*alignment
+
+# size of the parsed-file cache (in megabytes) when it's turned on with cache=True
+# but there's no "data_cache_megabytes" preference
+default_cache_megabytes = 1000
+
+def _cache_budget(cache=None):
+    """
+    Returns the parsed-file cache budget in bytes (0 means no caching).
+
+    cache=None uses the "data_cache_megabytes" preference (e.g. set
+    spinmob.settings['data_cache_megabytes'] = 500 to turn it on), True
+    turns it on even without the preference, and False turns it off.
+    """
+    if cache is False: return 0
+    try:    megabytes = float(_s.settings['data_cache_megabytes'])
+    except: megabytes = 0
+    if cache is True and megabytes <= 0: megabytes = default_cache_megabytes
+    return int(megabytes*1024**2)
+
+def _cache_path(path, first_data_line, delimiter, parser):
+    """
+    Returns the path of the cache entry for parsing the file at path with the
+    supplied options. The key includes the file's size and modification time,
+    so changed files get new entries (and the old ones age out).
+    """
+    path = _os.path.abspath(path)
+    info = _os.stat(path)
+    key  = repr((path, info.st_size, info.st_mtime, first_data_line, delimiter, parser))
+    return _os.path.join(_s.settings.path_home, 'cache', _hashlib.sha1(key).hexdigest()+'.bin')
+
+def _trim_cache(budget):
+    """
+    Deletes the least recently used cache entries (oldest modification time,
+    since we touch entries when we use them) until they fit in budget bytes.
+    """
+    directory = _os.path.join(_s.settings.path_home, 'cache')
+    entries   = []
+    for name in _os.listdir(directory):
+        try:
+            info = _os.stat(_os.path.join(directory, name))
+            entries.append((info.st_mtime, info.st_size, _os.path.join(directory, name)))
+        except: pass
+    entries.sort()
+
+    total = sum([e[1] for e in entries])
+    while total > budget and len(entries):
+        entry = entries.pop(0)
+        try:    _os.remove(entry[2])
+        except: continue   # e.g. still mapped on windows
+        total -= entry[1]
+
+def _write_columns(f, columns, delimiter='\t', float_format=None, chunk_rows=10000):
+    """
+    Writes the supplied columns to the open file f, one row per line,
+    formatting whole chunks of rows with a single % operation. Columns that
+    run out of data get the placeholder "_".
+
+    float_format=None formats real and complex numbers exactly like str().
+    Otherwise it is a %-format such as '%.10g' used for real numbers and
+    both parts of complex numbers.
+    """
+    columns = [_n.atleast_1d(_n.asarray(c)) for c in columns]
+    if not len(columns): return
+
+    # figure out the format of each column, whether complex columns need to
+    # be split into real and imaginary parts, and whether the values have to
+    # stay numpy scalars (repr() of float32 etc turned into python floats
+    # shows digits str() doesn't, so those are formatted with str())
+    formats = []
+    split   = []
+    scalars = []
+    for c in columns:
+        kind = c.dtype.kind
+        if   kind in 'iu':                        formats.append('%d')
+        elif kind in 'fc' and float_format is None: formats.append('%r')
+        elif kind == 'f':                         formats.append(float_format)
+        elif kind == 'c':                         formats.append('('+float_format+float_format.replace('%','%+',1)+'j)')
+        else:                                     formats.append('%s')
+        split.append(kind == 'c' and not float_format is None)
+        scalars.append(kind in 'fc' and float_format is None and not c.dtype in [_n.float64, _n.complex128])
+        if scalars[-1]: formats[-1] = '%s'
+
+    # the rows come in segments within which the same columns have data
+    lengths = [len(c) for c in columns]
+    edges   = sorted(set([0]+lengths))
+    for i in range(len(edges)-1):
+
+        # placeholders for columns that have run out of data
+        active = [m for m in range(len(columns)) if lengths[m] > edges[i]]
+        row    = []
+        for m in range(len(columns)):
+            if m in active: row.append(formats[m])
+            else:           row.append('_')
+        row = delimiter.join(row)+'\n'
+
+        # write the segment a chunk at a time
+        for start in range(edges[i], edges[i+1], chunk_rows):
+            stop = min(start+chunk_rows, edges[i+1])
+
+            values = []
+            for m in active:
+                if split[m]:
+                    values.append(columns[m][start:stop].real.tolist())
+                    values.append(columns[m][start:stop].imag.tolist())
+                elif scalars[m]:
+                    values.append(list(columns[m][start:stop]))
+                else:
+                    values.append(columns[m][start:stop].tolist())
+
+            f.write((row*(stop-start)) % tuple(_itertools.chain.from_iterable(zip(*values))))
+
+def _has_complex_token(text):
+    """
+    Returns True if the string contains something like "2.0i" or "3j". The
+    letter check is much quicker than the regular expression on large buffers.
+    """
+    for c in 'ijJ':
+        if c in text: return _complex_token.search(text) is not None
+    return False
+
+def _parse_data_text(text, delimiter=None, parser="fast"):
+    """
+    Converts a string of ascii data lines into a list of column arrays.
+
+    parser="fast"       Reads everything directly into float64 arrays, only
+                        using the complex conversion for columns that contain
+                        i or j tokens. Falls back to "complex" if the data is
+                        irregular (e.g. missing values or "_" placeholders).
+    parser="complex"    Converts everything to complex numbers, then drops the
+                        imaginary part of columns in which it is zero.
+    """
+    if parser == "fast":
+        try:    return _parse_data_text_fast(text, delimiter)
+        except: pass
+
+    # define a quick function to convert i's to j's
+    def fix(x): return x.replace('i','j')
+
+    # loop over the remaining data lines, converting to numbers
+    z = _n.genfromtxt((fix(x) for x in text.splitlines()),
+                      delimiter=delimiter,
+                      dtype=complex)
+
+    # genfromtxt returns a 1D array if there is only one data line.
+    # highly confusing behavior, numpy!
+    if len(_n.shape(z)) == 1: z = _n.array([z])
+
+    # fix for different behavior of genfromtxt on single columns
+    if len(z.shape) == 2: z = z.transpose()
+    else:                 z = [z]
+
+    # if any of the imaginary components are non-zero, use complex
+    columns = []
+    for x in z:
+        if _n.any(_n.imag(x)): columns.append(x)
+        else:                  columns.append(_n.real(x))
+    return columns
+
+def _parse_data_text_fast(text, delimiter=None):
+    """
+    Float-first version of _parse_data_text(). Raises an exception if the
+    data can't be read this way.
+    """
+    # comments are only understood by the slow path
+    if '#' in text: raise ValueError("comments in data")
+
+    lines = text.splitlines()
+    while len(lines) and lines[-1].strip() == '': lines.pop(-1)
+    column_count = len(lines[0].strip().split(delimiter))
+    row_count    = len(lines) - lines.count('')
+
+    # every line needs the same number of elements (a total that happens to
+    # add up isn't good enough)
+    if not delimiter is None: text = text.replace(delimiter, ' ')
+    if not (_elements_per_line(text) == column_count).all(): raise ValueError("irregular data")
+
+    # usual case: all real, so let numpy's C parser loose on the whole buffer,
+    # then make sure it read exactly one number per element.
+    if not _has_complex_token(text):
+        z = _n.fromstring(text, dtype=float, sep=' ')
+        if not len(z) == row_count*column_count: raise ValueError("irregular data")
+        return list(z.reshape(row_count, column_count).transpose())
+
+    # find the columns with complex entries (only lines that have them get split)
+    complex_columns = set()
+    for line in lines:
+        if _complex_token.search(line):
+            s = line.strip().split(delimiter)
+            for n in range(len(s)):
+                if _complex_token.search(s[n]): complex_columns.add(n)
+
+    # get the float columns in one go, then the complex columns
+    ns      = [n for n in range(column_count) if not n in complex_columns]
+    columns = [None]*column_count
+    if len(ns):
+        z = _n.loadtxt(lines, delimiter=delimiter, dtype=float, ndmin=2, usecols=ns)
+        for m in range(len(ns)): columns[ns[m]] = z[:,m]
+
+    ns = sorted(complex_columns)
+    z  = _n.loadtxt([x.replace('i','j') for x in lines], delimiter=delimiter, dtype=complex, ndmin=2, usecols=ns)
+    for m in range(len(ns)):
+        if _n.any(_n.imag(z[:,m])): columns[ns[m]] = z[:,m]
+        else:                       columns[ns[m]] = _n.real(z[:,m])
+
+    return columns
+
+
+
+
+# byte -> is it white space
+_white_space = _n.zeros(256, dtype=bool)
+_white_space[[9, 10, 11, 12, 13, 32]] = True
+
+def _elements_per_line(text):
+    """
+    Returns an array of the number of white-space-separated elements on each
+    non-blank line of text, counted with numpy rather than by splitting.
+    """
+    b = _n.frombuffer(text, dtype=_n.uint8)
+    if not len(b): return _n.zeros(0, dtype=int)
+    space = _white_space[b]
+
+    # elements start where white space (or the text) ends
+    starts = ~space
+    starts[1:] &= space[:-1]
+    line   = _n.cumsum(b == 10)
+    counts = _n.bincount(line[starts], minlength=line[-1]+1)
+    return counts[counts > 0]
+
+class _column_reader:
+
+    def __init__(self, path, offset, ckeys, delimiter=None, parser="fast"):
+        """
+        Decodes individual columns of the ascii data starting at byte offset
+        in the file. The data lines are read once and kept, so each column
+        after the first only costs splitting each line as far as that column.
+        Irregular data is parsed once with _parse_data_text(), after which
+        the lines are dropped.
+        """
+        self.path      = path
+        self.offset    = offset
+        self.ns        = dict([(ckeys[n], n) for n in range(len(ckeys))])
+        self.delimiter = delimiter
+        self.parser    = parser
+        self.lines     = None
+        self.parsed    = None
+
+    def __call__(self, ckey):
+        n = self.ns[ckey]
+        if self.parsed is not None: return self.parsed[n]
+
+        # read the data lines once
+        if self.lines is None:
+            f = _open(self.path)
+            f.seek(self.offset)
+            self.lines = [x for x in f.read().splitlines() if x.strip()]
+            f.close()
+
+        if self.parser == "fast":
+            try:    return _n.array([x.split(self.delimiter, n+1)[n] for x in self.lines], dtype=float)
+            except: pass
+
+        # parse everything and keep the columns instead of the lines
+        self.parsed = _parse_data_text('\n'.join(self.lines), self.delimiter, self.parser)
+        self.lines  = None
+        return self.parsed[n]
+
+class _h5_reader:
+
+    def __init__(self, path, group=None, rows=None):
+        """
+        Column loader (see _lazy_columns) reading each column's dataset from
+        the group (None for the root) of the HDF5 file. rows is a slice, in
+        which case only those rows are read (and only the chunks holding
+        them are decompressed).
+        """
+        self.path  = path
+        self.group = group
+        self.rows  = rows
+
+    def __call__(self, ckey):
+        f = _h5py.File(self.path, 'r')
+        try:
+            d = _h5_group(f, self.group)[ckey]
+            if self.rows is None or len(d) == 0: return d[...]
+            return d[self.rows]
+        finally:
+            f.close()
+
+def _h5_group(f, group=None):
+    """
+    Returns the named group of the open HDF5 file f (the root if group is None).
+    """
+    if group is None: return f
+    return f[group]
+
+def h5_groups(path):
+    """
+    Returns the names of the groups in the HDF5 file holding a databox (saved
+    with databox.save_h5()), including '/' if the root of the file holds one.
+    """
+    if _h5py is None:
+        print "ERROR: h5_groups() needs the h5py module."
+        return None
+
+    names = []
+    def visit(name, x):
+        if isinstance(x, _h5py.Group) and 'spinmob_ckeys' in x.attrs: names.append(str(name))
+
+    f = _h5py.File(path, 'r')
+    if 'spinmob_ckeys' in f.attrs: names.append('/')
+    f.visititems(visit)
+    f.close()
+    return names
+
+class _column_view:
+
+    def __init__(self, columns, index):
+        """
+        Column loader (see _lazy_columns) returning column[index] for the
+        supplied dictionary of columns, where index is a slice or an array of
+        indices. Slices give zero-copy views, which are made read-only so
+        nobody can accidentally write into the original data.
+        """
+        self.columns = columns
+        self.index   = index
+
+    def __call__(self, ckey):
+        x = self.columns[ckey][self.index]
+        if isinstance(self.index, slice): x.flags.writeable = False
+        return x
+
+class _lazy_columns(_UserDict.DictMixin):
+
+    def __init__(self, loader, keys):
+        """
+        Columns dictionary that calls loader(key) the first time an unloaded
+        key is asked for, then keeps the result. Unloaded keys still show up
+        in keys(), len(), "in", dict() etc, so it behaves like a normal
+        dictionary. copy() shares the loader, so the copy is lazy too.
+        """
+        self._loaded  = {}
+        self._loader  = loader
+        self._pending = set(keys)
+
+    def __getitem__(self, key):
+        if key in self._loaded:       return self._loaded[key]
+        if not key in self._pending: raise KeyError(key)
+        value = self._loader(key)
+        self[key] = value
+
+        # once everything is loaded, we don't need the loader (or its data)
+        if not len(self._pending): self._loader = None
+        return value
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        self._loaded[key] = value
+
+    def __delitem__(self, key):
+        if key in self._pending: self._pending.discard(key)
+        else:                    del self._loaded[key]
+
+    def __contains__(self, key): return key in self._pending or key in self._loaded
+    def __len__(self):           return len(self._loaded) + len(self._pending)
+    def __iter__(self):          return iter(self.keys())
+
+    has_key = __contains__
+
+    def keys(self): return self._loaded.keys() + list(self._pending)
+
+    def pop(self, key, *default):
+        if key in self._pending: self[key]
+        return self._loaded.pop(key, *default)
+
+    def copy(self):
+        c = _lazy_columns(self._loader, self._pending)
+        c._loaded.update(self._loaded)
+        return c
+
+class _key_list(list):
+    """
+    Ordered list of (header) keys that also keeps a count of each key, so
+    "key in keys" is O(1), and a lazily built index of the three-letter pieces
+    of the keys, so find() doesn't have to scan every key.
+
+    Appending keeps everything up to date. Anything else that changes the
+    list just throws the index away, to be rebuilt when next needed.
+    """
+
+    def __init__(self, keys=[]):
+        list.__init__(self, keys)
+        self._reset()
+
+    def _reset(self):
+        self._counts   = None   # key -> number of times it's in the list
+        self._trigrams = None   # three-letter piece -> positions of keys containing it
+        self._indexed  = 0      # number of keys in self._trigrams
+        self._found    = {}     # fragment -> first key containing it
+
+    def _get_counts(self):
+        if self._counts is None:
+            self._counts = {}
+            for k in self: self._counts[k] = self._counts.get(k, 0) + 1
+        return self._counts
+
+    def __reduce__(self):
+        return (_key_list, (list(self),))
+
+    def __contains__(self, key):
+        try:    return key in self._get_counts()
+        except: return list.__contains__(self, key)
+
+    def append(self, key):
+        list.append(self, key)
+        if self._counts is not None: self._counts[key] = self._counts.get(key, 0) + 1
+
+    def _changed(method):
+        def f(self, *a, **kw):
+            self._reset()
+            return method(self, *a, **kw)
+        f.__name__ = method.__name__
+        return f
+
+    for _m in ['insert', 'pop', 'remove', 'extend', 'sort', 'reverse', '__setitem__',
+               '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__']:
+        locals()[_m] = _changed(getattr(list, _m))
+    del _m, _changed
+
+    def find(self, fragment):
+        """
+        Returns the first key containing the string fragment, or None.
+        """
+        if fragment in self._found: return self._found[fragment]
+
+        # index the keys we haven't seen yet
+        if self._trigrams is None: self._trigrams = {}
+        for n in range(self._indexed, len(self)):
+            k = str(self[n])
+            for piece in set([k[i:i+3] for i in range(len(k)-2)]):
+                self._trigrams.setdefault(piece, []).append(n)
+        self._indexed = len(self)
+
+        # only keys containing the fragment's rarest piece need checking
+        if len(fragment) >= 3:
+            candidates = min([self._trigrams.get(fragment[i:i+3], []) for i in range(len(fragment)-2)], key=len)
+        else:
+            candidates = range(len(self))
+
+        for n in candidates:
+            if self[n].find(fragment) >= 0:
+                self._found[fragment] = self[n]
+                return self[n]
+        return None
+
+
+
+
+#############################################################
+# Compiled scripts
+#############################################################
+
+_script_cache = {}      # script text -> [expression, code, variables, fused]
+_script_cache_size = 1000
+
+def _compile_script(script):
+    """
+    Splits a databox script such as "a/b where a=c(0); b=3.3" into its
+    expression and variable clauses, and compiles them. The results are
+    cached by script text, so scripts that get run over and over (e.g. by
+    plot.xy.databoxes() or DataboxPlot) are only parsed once.
+
+    Returns [expression, code, variables, fused], where code is the compiled
+    expression (None if it doesn't compile), and variables is None for
+    scripts without a "where", or a list of [name, sub-script] pairs. A clause
+    with no "=" in it is stored as the list of its pieces. fused is the
+    _fused.expression for the arithmetic (None if there isn't any).
+    """
+    try:    return _script_cache[script]
+    except: pass
+
+    # first split up by "where"
+    split_script = script.split(" where ")
+
+    # simple script like "column0" or "c(3)/2.0"
+    if len(split_script) == 1:
+        expression = script
+        variables  = None
+
+    # complicated script like "c(1)-a/2 where a=h('this')"
+    else:
+        expression = split_script[0].strip()
+        variables  = []
+        for var in split_script[1].split(';'):
+
+            # split each entry by the "=" sign
+            s = var.split("=")
+            if len(s) == 1: variables.append(s)
+            else:           variables.append([s[0].strip(), s[1].strip()])
+
+    # compile the expression; if it fails, eval() will complain later
+    try:    code = compile(expression, '<script>', 'eval')
+    except: code = None
+
+    # keep the cache from growing forever
+    if len(_script_cache) >= _script_cache_size: _script_cache.clear()
+    _script_cache[script] = [expression, code, variables, _fused.compile_expression(expression)]
+    return _script_cache[script]
+
+def _script_names(scripts):
+    """
+    Returns the set of names used by the fitter data scripts (the strings in
+    the supplied list), including inside lambdas etc. Returns None if we can't
+    tell what they depend on (they use 'self', or don't compile).
+    """
+    names = set()
+    for script in scripts:
+        if not type(script) is str: continue
+        try:    codes = [compile(script, '<script>', 'eval')]
+        except: return None
+
+        while len(codes):
+            code = codes.pop()
+            names.update(code.co_names)
+            names.update(code.co_varnames)
+            codes = codes + [c for c in code.co_consts if hasattr(c, 'co_code')]
+
+    if 'self' in names: return None
+    return names
+
+def _has_nested_scopes(code):
+    """
+    Returns True if the compiled code defines lambdas, generators etc.
+    """
+    for c in getattr(code, 'co_consts', ()):
+        if hasattr(c, 'co_code'): return True
+    return False
+
+
+
+
 #############################################################
 # Class for storing / manipulating / saving / loading data
 #############################################################
@@ -39,13 +918,24 @@ class databox:
 
     debug          = False  # Use this to print debug info in various places
     delimiter      = None   # delimiter of the ascii file. If "None" this will just use any whitespace
+    storage        = 'dict' # 'dict' stores independent column arrays, 'block' shares one contiguous 2-D array
+    max_points     = None   # if not None, append_data_point() keeps only this many of the most recent points
+    evaluator      = 'eval' # 'fused' evaluates script arithmetic in one pass (see _fused.py)
 
     headers = {}            # this dictionary will hold the header information
     columns = {}            # this dictionary will hold the data columns
     ckeys   = []            # we need a special list of column keys to keep track of their order during data assembly
     hkeys   = []            # ordered list of header keys
     extra_globals = {}
+    eval_headers  = False   # if True, header values that aren't literals are eval()'d with the script globals
 
+    _block  = None          # _column_block used when storage='block'
+    _globals_cache = None   # [state, globals dictionary] from the last _globals() call
+    _masks         = {}     # trim() condition string (or tuple of them) -> mask (or indices)
+    _buffers = {}           # ckey -> [growable buffer, view of its filled region] for append_data_point()
+    _appended = None        # [path, ckeys, delimiter, rows, appends, edits, file size] after the last save_file(append=True)
+    _appends  = 0           # number of data points ever appended with append_data_point()
+    _edits    = 0           # number of times columns were set, removed or cleared
 
 
     def __setitem__(self, n, x):
@@ -59,7 +949,7 @@ class databox:
             self.insert_column(data_array=x, ckey='_column'+str(len(self.ckeys)), index=None)
 
         else:
-            self.columns[self.ckeys[n]] = _n.array(x)
+            self.insert_column(data_array=x, ckey=self.ckeys[n])
 
     def __len__(self):
         return len(self.ckeys)
@@ -69,11 +959,22 @@ class databox:
         for n in range(i,min(j, len(self))): output.append(self[n])
         return output
 
-    def __init__(self, delimiter=None, debug=False, **kwargs):
+    def __init__(self, delimiter=None, debug=False, storage='dict', max_points=None, **kwargs):
         """
         delimiter    The delimiter the file uses. None (default) means
                      "Try to figure it out" (reasonably smart)
         debug        Displays some partial debug information while running
+        storage      'dict' (default) keeps each column as its own array.
+                     'block' keeps all same-length, same-dtype numeric columns
+                     in one preallocated 2-D array, and c() / self[n] return
+                     zero-copy views into it. Columns whose length or dtype
+                     diverge are copied out of the block.
+        max_points   If not None, append_data_point() treats the columns as
+                     ring buffers holding only the most recent max_points
+                     data points, overwriting the oldest ones without
+                     reallocating. The columns are always time-ordered views.
+                     insert_data_point() at an index also drops the oldest
+                     (first) points beyond max_points.
 
         **kwargs are sent to self.h()
         """
@@ -84,6 +985,30 @@ class databox:
 
         self.debug     = debug
         self.delimiter = delimiter
+        self.storage    = storage
+        self.max_points = max_points
+
+    def __getstate__(self):
+        """
+        Returns the state for pickle (used e.g. to send databoxes between
+        processes). The caches are left out, and lazy, ring-buffer and block
+        columns are sent as plain arrays.
+        """
+        state = dict(self.__dict__)
+        for k in ['_globals_cache', '_masks', '_buffers', '_block', '_appended']: state.pop(k, None)
+        state['columns'] = dict([(k, self.columns[k]) for k in self.columns.keys()])
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the state from __getstate__(), rebuilding the block if needed.
+        """
+        self.__dict__.update(state)
+        self._buffers = {}
+        self._changed()
+
+        if self.storage == 'block':
+            for k in self.ckeys: self.columns[k] = self._block_column(k, self.columns[k])
 
     def __repr__(self):
 
@@ -105,8 +1030,19 @@ class databox:
     def _globals(self):
         """
         Returns the globals needed for eval() statements.
+
+        The dictionary is kept between calls and only rebuilt when
+        self.extra_globals (or numpy's namespace) changes, so don't modify it.
         """
 
+        # what the globals were built from: the values are all referenced by
+        # the cached dictionary, so their ids can't be recycled
+        state = [id(self.extra_globals), len(_n.__dict__)]
+        for k, v in self.extra_globals.iteritems(): state.append((k, id(v)))
+
+        if self._globals_cache is not None and self._globals_cache[0] == state:
+            return self._globals_cache[1]
+
         # start with numpy
         globbies = dict(_n.__dict__)
 
@@ -116,9 +1052,20 @@ class databox:
         # update with user stuff
         globbies.update(self.extra_globals)
 
+        self._globals_cache = [state, globbies]
+
+        # anything computed with the old globals is suspect
+        self._changed()
         return globbies
 
-    def load_file(self, path="ask", first_data_line="auto", filters="*.*", text="Select a file, FACEPANTS.", default_directory=None, header_only=False, quiet=False):
+    def _changed(self):
+        """
+        Forgets everything computed from the columns, headers and globals
+        (e.g. the trim() masks). Called by everything that changes them.
+        """
+        self._masks = {}
+
+    def load_file(self, path="ask", first_data_line="auto", filters="*.*", text="Select a file, FACEPANTS.", default_directory=None, header_only=False, quiet=False, parser="fast", lazy=False, cache=None):
         """
         This will clear the databox, load a file, storing the header info in self.headers, and the data in
         self.columns
@@ -133,6 +1080,23 @@ class databox:
         In both cases, the line used to label the columns will always be the last
         header line with the same (or more) number of elements as the first data line.
 
+        parser="fast" reads the data straight into float64 arrays, using the
+        (slower) complex conversion only for columns containing i or j
+        tokens, and falls back to parser="complex" (convert everything as
+        complex, then drop zero imaginary parts) for irregular data such as
+        "_" placeholders.
+
+        lazy=True only reads the header and ckeys up front. Each column is
+        decoded from the file the first time it's asked for (e.g. by c() or
+        self[n]) and kept from then on, which is much quicker for wide files
+        when only a few columns are used.
+
+        cache=None keeps the parsed (binary) form of the file in the
+        "cache" folder of spinmob.settings.path_home, so loading it again
+        (until it changes) is just a memory-mapped open. None uses the
+        "data_cache_megabytes" preference (no preference means no caching),
+        True caches even without the preference and False doesn't. The least
+        recently used entries are deleted to stay within the budget.
         """
 
         if default_directory is None: default_directory = self.directory
@@ -152,61 +1116,240 @@ class databox:
             if not quiet: print "ERROR: "+repr(path)+" does not exist."
             return None
 
+        # binary files know how to load themselves
+        if _is_binary_file(path): return self.load_binary(path, header_only=header_only, quiet=quiet)
+
+        # see if we've parsed this file before
+        budget     = _cache_budget(cache)
+        cache_path = None
+        if budget and not header_only:
+            cache_path = _cache_path(path, first_data_line, self.delimiter, parser)
+            if self._load_from_cache(cache_path, path): return self
+
         # clear all the existing data
         self.clear()
 
-        # open said file for reading, read in all the lines and close
-        f = open(path, 'rU')
-        lines = f.readlines()
+        # open said file for reading (decompressing on the fly if needed)
+        f = _open(path)
+
+        # Determine the delimiter from the last line of the file
+        if self.delimiter is None: self.delimiter = _sniff_delimiter(f)
+
+        # read the header, stopping at the first data line
+        first_data_line, ckeys_line, first_line, offset = self._read_header(f, first_data_line)
+
+        # now we have a valid set of column ckeys one way or another, and we know first_data_line.
+        if header_only:
+            f.close()
+            return self
+
+        # Make sure first_data_line isn't None (which happens if there's no data)
+        if first_data_line == "auto":
+            f.close()
+            if not quiet: print "\nCould not find a line of pure data! Perhaps check the delimiter?"
+            if not quiet: print "The default delimiter is whitespace. For csv files, set delimiter=','\n"
+            return self
+
+        ##### at this point we've found the first_data_line,
+        self._set_ckeys_from_lines(ckeys_line, first_line, quiet)
+
+        # lazy loading: decode the columns as they're asked for
+        if lazy:
+            f.close()
+            self.columns = _lazy_columns(_column_reader(path, offset, self.ckeys, self.delimiter, parser), self.ckeys)
+
+            # (this loads just the renamed columns)
+            self._rename_obnoxious_ckeys()
+            return self
+
+        # initialize the columns arrays
+        # I did benchmarks and there's not much improvement by using numpy-arrays here.
+        for label in self.ckeys: self.columns[label] = []
+
+        # convert the remaining data lines to columns of numbers
+        z = _parse_data_text(first_line + f.read(), self.delimiter, parser)
         f.close()
 
-        # Determine the delimiter
-        if self.delimiter is None:
+        # for contiguous storage, we know how many columns to preallocate
+        if self.storage == 'block': self._block = _column_block(len(z[0]), _n.asarray(z[0]).dtype, len(self.ckeys))
+
+        # Add all the columns
+        for n in range(len(self.ckeys)): self[n] = z[n]
+
+        # now, as an added bonus, rename some of the obnoxious headers
+        self._rename_obnoxious_ckeys()
+
+        # keep the parsed data for next time
+        if cache_path is not None: self._store_in_cache(cache_path, budget)
+
+        return self
+
+    def _rename_obnoxious_ckeys(self):
+        """
+        Adds the unified names from self.obnoxious_ckeys for any such columns.
+        """
+        for k in self.obnoxious_ckeys:
+            if self.columns.has_key(k):
+                self.columns[self.obnoxious_ckeys[k]] = self.columns[k]
+
+    def _load_from_cache(self, cache_path, path):
+        """
+        Loads the cache entry at cache_path (see load_file()) if it exists,
+        pretending it came from path. Returns True if it worked.
+        """
+        if not _os.path.exists(cache_path): return False
+
+        try:
+            if self.load_binary(cache_path, quiet=True) is None: return False
+        except: return False
+
+        # mark it as recently used
+        try:    _os.utime(cache_path, None)
+        except: pass
+
+        self.path = path
+        self._rename_obnoxious_ckeys()
+        return True
+
+    def _store_in_cache(self, cache_path, budget):
+        """
+        Saves the (numeric) columns and header to cache_path (see load_file()),
+        then deletes old entries to stay within budget bytes.
+        """
+        for k in self.ckeys:
+            a = _n.asarray(self[k])
+            if not a.ndim == 1 or not a.dtype.kind in 'biufc': return
+
+        path = self.path
+        try:
+            _s.settings.MakeDir('cache')
+            self.save_binary(cache_path, force_overwrite=True)
+            _trim_cache(budget)
+        except: pass
+        self.path = path
+
+    def iter_chunks(self, path="ask", rows=10000, first_data_line="auto", filters="*.*", text="Select a file, FACEPANTS.", quiet=False, parser="fast"):
+        """
+        Generator that loads the header of a file into this databox, then
+        yields new databoxes (each with a copy of the header) holding
+        successive chunks of at most the specified number of rows. Only one
+        chunk is in memory at a time, so this works for files larger than
+        memory. For example:
+
+            total = 0
+            for d in spinmob.data.iter_chunks('huge.dat', rows=100000):
+                total += sum(d['signal'])
+
+        The remaining arguments are the same as load_file(). Note each chunk
+        is parsed on its own, so a column may be real in one chunk and
+        complex in another.
+        """
+        if path == "ask":
+            path = _dialogs.open_single(filters=filters,
+                                        default_directory=self.directory,
+                                        text=text)
+        self.path = path
+
+        if path is None:
+            if not quiet: print "Aborted."
+            return
+
+        # make sure the file exists!
+        if not _os.path.exists(path):
+            if not quiet: print "ERROR: "+repr(path)+" does not exist."
+            return
 
-            # loop from the end of the file until we get something other than white space
-            for n in range(len(lines)):
+        # binary files are memory-mapped already, so just hand out slices
+        if _is_binary_file(path):
+            if self.load_binary(path, quiet=quiet) is None: return
 
-                # strip away the white space
-                s = lines[-n-1].strip()
+            columns = [self[k] for k in self.ckeys]
+            self.columns = {}
+            if not len(columns): return
+            for n in range(0, len(columns[0]), rows):
+                yield self._new_chunk([c[n:n+rows] for c in columns])
+            return
 
-                # if this line has any content
-                if len(s) > 0:
+        # clear all the existing data
+        self.clear()
 
-                    # try the different delimiter schemes until we find one
-                    # that produces a number. Otherwise it's ambiguous.
-                    if   _s.fun.is_a_number(s.split(None)[0]): self.delimiter = None
-                    elif _s.fun.is_a_number(s.split(',') [0]): self.delimiter = ','
-                    elif _s.fun.is_a_number(s.split(';') [0]): self.delimiter = ';'
+        # read the header and ckeys once
+        f = _open(path)
+        try:
+            if self.delimiter is None: self.delimiter = _sniff_delimiter(f)
+            first_data_line, ckeys_line, line, offset = self._read_header(f, first_data_line)
 
-                    # quit the loop!
-                    break
+            if first_data_line == "auto":
+                if not quiet: print "\nCould not find a line of pure data! Perhaps check the delimiter?"
+                return
+            self._set_ckeys_from_lines(ckeys_line, line, quiet)
 
+            # now parse the data a chunk at a time
+            lines = [line]
+            for line in f:
+                if line.strip() == '': continue
 
+                # hand out a full chunk before starting the next one
+                if len(lines) >= rows:
+                    yield self._new_chunk(_parse_data_text(''.join(lines), self.delimiter, parser))
+                    lines = []
+                lines.append(line)
 
-        ##### read in the header information
+            # leftovers
+            if len(lines): yield self._new_chunk(_parse_data_text(''.join(lines), self.delimiter, parser))
+
+        finally: f.close()
+
+    def _new_chunk(self, columns):
+        """
+        Returns a new databox with our options, header and ckeys, filled with
+        the supplied list of column arrays.
+        """
+        d = databox(delimiter=self.delimiter, storage=self.storage)
+        d.path = self.path
+        d.copy_headers(self)
+        for n in range(len(self.ckeys)): d.insert_column(columns[n], self.ckeys[n])
+        return d
+
+    def _read_header(self, f, first_data_line="auto"):
+        """
+        Reads lines from the open file f up to the first data line, storing
+        them in self.header_lines and the header. Nothing after the first data
+        line is read.
+
+        first_data_line="auto" means stop at the first line where all the
+        elements are numbers. Otherwise it's the index of the first data line.
+
+        Returns the index of the first data line, the line above it, the
+        first data line itself, and its position in the file ("auto", None,
+        None, None if there is no data).
+        """
         self.header_lines = []
+        previous = None
+
+        n = 0
+        while True:
 
-        for n in range(len(lines)):
+            # read the next line, quitting if there's no more file
+            offset = f.tell()
+            line   = f.readline()
+            if line == '': return "auto", None, None, None
 
             # split the line by the delimiter
-            s = lines[n].strip().split(self.delimiter)
+            s = line.strip().split(self.delimiter)
 
             # remove a trailing whitespace entry if it exists.
             if len(s) and s[-1].strip() == '': s.pop(-1)
 
-            # first check and see if this is a data line (all elements are numbers)
-            if first_data_line == "auto" and _s.fun.elements_are_numbers(s):
-
-                # we've reached the first data line
-                first_data_line = n
-
-                # quit the header loop
-                break;
+            # first check and see if this is a data line
+            if first_data_line == "auto":
+                if _elements_are_numbers(s): return n, previous, line, offset
+            elif n >= first_data_line:        return n, previous, line, offset
 
             ### now we know it's a header line
 
             # save the lines for the avid user.
-            self.header_lines.append(lines[n].strip())
+            self.header_lines.append(line.strip())
 
             # store the hkey and the rest of it
             if len(s):
@@ -214,35 +1357,47 @@ class databox:
                 if self.delimiter is None: remainder = ' '.join(s[1:])
                 else:                      remainder = self.delimiter.join(s[1:])
 
-                # first thing to try is simply evaluating the remaining string
-                try: self.insert_header(hkey, eval(remainder, self._globals()))
+                self.insert_header(hkey, self._decode_header_value(remainder))
 
-                # otherwise store the string
-                except: self.insert_header(hkey, remainder)
+            previous = line
+            n += 1
 
-        # now we have a valid set of column ckeys one way or another, and we know first_data_line.
-        if header_only: return self
-
-        # Make sure first_data_line isn't None (which happens if there's no data)
-        if first_data_line == "auto":
-            if not quiet: print "\nCould not find a line of pure data! Perhaps check the delimiter?"
-            if not quiet: print "The default delimiter is whitespace. For csv files, set delimiter=','\n"
-            return self
+    def _decode_header_value(self, remainder):
+        """
+        Converts the string following a header key into a value.
 
+        Literals (anything repr() of the usual header values gives, including
+        numpy arrays) are decoded without eval(). Other expressions are only
+        evaluated if self.eval_headers is True.
+        """
+        # first thing to try is decoding a literal
+        try: return _decode_literal(remainder)
+        except: pass
 
+        # then (if we're allowed) evaluating the remaining string
+        if self.eval_headers:
+            try:    return eval(remainder, self._globals())
+            except: pass
 
-        ##### at this point we've found the first_data_line,
+        # otherwise store the string
+        return remainder
 
+    def _set_ckeys_from_lines(self, ckeys_line, first_line, quiet=False):
+        """
+        Sets self.ckeys from the line above the first data line (or None if
+        there is no header), generating keys if it doesn't have enough
+        elements, and making sure they're all different.
+        """
         # look for the ckeys
 
         # special case: no header
-        if first_data_line == 0: ckeys = []
+        if ckeys_line is None: ckeys = []
 
         # start by assuming it's the previous line
-        else: ckeys = lines[first_data_line-1].strip().split(self.delimiter)
+        else: ckeys = ckeys_line.strip().split(self.delimiter)
 
         # count the number of actual data columns for comparison
-        column_count = len(lines[first_data_line].strip().split(self.delimiter))
+        column_count = len(first_line.strip().split(self.delimiter))
 
         # check to see if ckeys is equal in length to the
         # number of data columns. If it isn't, it's a false ckeys line
@@ -262,119 +1417,388 @@ class databox:
         self.ckeys = []
         while len(ckeys):
 
-            # remove the key
-            ckey = ckeys.pop(0)
+            # remove the key
+            ckey = ckeys.pop(0)
+
+            # if there is a duplicate
+            if (ckey in ckeys) or (ckey in self.ckeys):
+                # increase the label index until it's unique
+                n=0
+                while (ckey+"_"+str(n) in ckeys) or (ckey+"_"+str(n) in self.ckeys): n+=1
+                ckey = ckey+"_"+str(n)
+            self.ckeys.append(ckey)
+
+    def save_file(self, path="ask", filters="*.dat", force_overwrite=False, header_only=False, delimiter='use current', float_format=None, compression_level=None, append=False, fsync=False):
+        """
+        This will save all the header info and columns to an ascii file with
+        the specified path.
+
+        filters="*.dat"         File filter for the file dialog (for path="ask")
+        force_overwrite=False   Normally, if the file * exists, this will copy that
+                                to *.backup. If the backup already exists, this
+                                function will abort. Setting this to True will
+                                force overwriting the backup file.
+        header_only=False       Only output the header?
+        delimiter="use current" This will set the delimiter of the output file
+                                "use current" means use self.delimiter
+        float_format=None       Format of real numbers (and both parts of complex
+                                numbers), e.g. '%.10g'. None means the same as
+                                str(), i.e. full precision.
+        compression_level=None  Paths ending in .gz, .bz2 or .xz are compressed
+                                while writing. This is the compression level
+                                (1-9 for .gz and .bz2, 0-9 for .xz); None means
+                                6 for .gz and .xz, 9 for .bz2.
+        append=False            If True, and this databox saved to the same path
+                                with append=True last time, only the rows added
+                                since then are written onto the end of the file
+                                (no temporary file or backup). The header is not
+                                rewritten. If that's not possible (the ckeys
+                                changed, columns were set, popped or cleared
+                                rather than just appended to, the columns are
+                                ragged, max_points is set, the file was changed
+                                by someone else, or it's compressed) the whole
+                                file is saved as usual. Changes made directly
+                                to the column arrays (e.g. d['x'][3] = 2) are
+                                not noticed.
+        fsync=False             With append=True, also fsync() the file after
+                                writing, so the rows survive a crash or power
+                                failure (slower).
+        """
+
+        # This is the final path. We now write to a temporary file in the user
+        # directory, then move it to the destination. This (hopefully) fixes
+        # problems with sync programs.
+        if path == "ask": path = _dialogs.save(filters, default_directory=self.directory)
+        if path in ["", None]:
+            print "Aborted."
+            return False
+
+        # Save the path for future reference
+        self.path=path
+
+        # get the delimiter
+        if delimiter == "use current":
+            if self.delimiter is None: delimiter = "\t"
+            else:                      delimiter = self.delimiter
+
+        # just add the new rows if we can
+        if append and not header_only and self._append_rows(path, delimiter, float_format, fsync): return
+
+        # if the path exists, make a backup
+        if _os.path.exists(path) and not force_overwrite:
+            _os.rename(path,path+".backup")
+
+        # figure out the temporary path
+        temporary_path = _os.path.join(_s.settings.path_home, "temp-"+str(int(1e3*_time.time()))+'-'+str(int(1e9*_n.random.rand(1))))
+        
+        # open the file (compressing if the final path says so) and write the header
+        f = _open(temporary_path, 'w', _compression(path), compression_level)
+        for k in self.hkeys: f.write(k + delimiter + repr(self.headers[k]) + "\n")
+        f.write('\n')
+
+        # if we're only supposed to write the header
+        if not header_only:
+
+            # now write the ckeys
+            elements = []
+            for ckey in self.ckeys: elements.append(str(ckey))
+            f.write(delimiter.join(elements) + "\n")
+
+            # now write the data in big blocks
+            _write_columns(f, [self[k] for k in self.ckeys], delimiter, float_format)
+
+        f.close()
+
+        # now move it
+        _shutil.move(temporary_path, path)
+
+        # remember what we wrote so the next save_file(append=True) can add to it
+        self._appended = None
+        if append and not header_only and _compression(path) is None and self.max_points is None:
+            lengths = set([len(self[k]) for k in self.ckeys])
+            if len(lengths) == 1:
+                self._appended = [path, list(self.ckeys), delimiter, lengths.pop(),
+                                  self._appends, self._edits, _os.path.getsize(path)]
+
+    def _append_rows(self, path, delimiter, float_format=None, fsync=False):
+        """
+        Writes the rows added since the last save_file(append=True) onto the
+        end of path. Returns False without writing anything if the file can't
+        just be appended to.
+        """
+        if self._appended is None or not self.max_points is None: return False
+        old_path, ckeys, old_delimiter, rows, appends, edits, size = self._appended
+
+        # same file, same columns, same delimiter, and nobody else touched it
+        if not (old_path, ckeys, old_delimiter) == (path, self.ckeys, delimiter): return False
+        if not _os.path.exists(path) or not _os.path.getsize(path) == size:       return False
+
+        # no columns were set, popped or cleared since, only appended to
+        if not edits == self._edits: return False
+
+        # all the columns must have grown by exactly the appended points
+        lengths = set([len(self[k]) for k in self.ckeys])
+        N       = rows + self._appends - appends
+        if not lengths == set([N]): return False
+
+        f = open(path, 'a')
+        _write_columns(f, [self[k][rows:N] for k in self.ckeys], delimiter, float_format)
+        f.flush()
+        if fsync: _os.fsync(f.fileno())
+        f.close()
+
+        self._appended[3] = N
+        self._appended[4] = self._appends
+        self._appended[6] = _os.path.getsize(path)
+        return True
+
+
+    def save_binary(self, path="ask", filters="*.*", force_overwrite=False):
+        """
+        Saves the header and columns to a binary file, which can be loaded
+        (much faster than ascii) with load_binary(), load_file() or
+        spinmob.data.load().
+
+        The file starts with a one-line magic string and a one-line JSON
+        preamble holding the hkeys, repr() of the header values, ckeys and
+        column layout. The columns follow as raw little-endian arrays, each
+        starting on a 64-byte boundary.
+
+        filters="*.*"           File filter for the file dialog (for path="ask")
+        force_overwrite=False   Normally, if the file * exists, this will copy that
+                                to *.backup. Setting this to True will just
+                                overwrite the file.
+        """
+        if path == "ask": path = _dialogs.save(filters, default_directory=self.directory)
+        if path in ["", None]:
+            print "Aborted."
+            return False
+
+        # make sure all the columns can be stored as raw numbers
+        columns = []
+        for k in self.ckeys:
+            a = _n.asarray(self[k])
+            if not a.ndim == 1 or not a.dtype.kind in 'biufc':
+                print "ERROR: Column '"+str(k)+"' is not a 1-D numeric array and can't be saved in binary."
+                return False
+            columns.append(_n.ascontiguousarray(a, a.dtype.newbyteorder('<')))
+
+        # Save the path for future reference
+        self.path=path
+
+        # assemble the preamble
+        layout = []
+        offset = 0
+        for a in columns:
+            layout.append(dict(dtype=a.dtype.str, length=len(a), offset=offset))
+            offset += _binary_padded(a.nbytes)
+
+        preamble = dict(delimiter    = self.delimiter,
+                        hkeys        = list(self.hkeys),
+                        headers      = [repr(self.headers[k]) for k in self.hkeys],
+                        header_lines = list(getattr(self, 'header_lines', [])),
+                        ckeys        = list(self.ckeys),
+                        columns      = layout)
+
+        # if the path exists, make a backup
+        if _os.path.exists(path) and not force_overwrite:
+            _os.rename(path,path+".backup")
+
+        # figure out the temporary path
+        temporary_path = _os.path.join(_s.settings.path_home, "temp-"+str(int(1e3*_time.time()))+'-'+str(int(1e9*_n.random.rand(1))))
+
+        # write the magic, preamble and data
+        f = open(temporary_path, 'wb')
+        f.write(_binary_magic)
+        f.write(_json.dumps(preamble)+'\n')
+        f.write('\0'*(_binary_padded(f.tell())-f.tell()))
+        for a in columns:
+            a.tofile(f)
+            f.write('\0'*(_binary_padded(a.nbytes)-a.nbytes))
+        f.close()
+
+        # now move it
+        _shutil.move(temporary_path, path)
+        return True
+
+    def load_binary(self, path="ask", filters="*.*", text="Select a file, FACEPANTS.", header_only=False, quiet=False):
+        """
+        Loads a file written by save_binary(). The columns are memory-mapped
+        (copy-on-write, so changes stay in memory), meaning only the parts of
+        the file you actually use are read from disk.
+        """
+        if path == "ask":
+            path = _dialogs.open_single(filters=filters,
+                                        default_directory=self.directory,
+                                        text=text)
+        self.path = path
+
+        if path is None:
+            if not quiet: print "Aborted."
+            return None
 
-            # if there is a duplicate
-            if (ckey in ckeys) or (ckey in self.ckeys):
-                # increase the label index until it's unique
-                n=0
-                while (ckey+"_"+str(n) in ckeys) or (ckey+"_"+str(n) in self.ckeys): n+=1
-                ckey = ckey+"_"+str(n)
-            self.ckeys.append(ckey)
+        # make sure it's the right kind of file
+        if not _is_binary_file(path):
+            if not quiet: print "ERROR: "+repr(path)+" is not a spinmob binary file."
+            return None
 
-        # initialize the columns arrays
-        # I did benchmarks and there's not much improvement by using numpy-arrays here.
-        for label in self.ckeys: self.columns[label] = []
+        # clear all the existing data
+        self.clear()
 
-        # define a quick function to convert i's to j's
-        def fix(x): return x.replace('i','j')
+        # read the preamble
+        f = open(path, 'rb')
+        f.readline()
+        preamble    = _json.loads(f.readline())
+        data_offset = _binary_padded(f.tell())
+        f.close()
 
-        # loop over the remaining data lines, converting to numbers
-        z = _n.genfromtxt((fix(x) for x in lines[first_data_line:]),
-                          delimiter=self.delimiter,
-                          dtype=complex)
+        if self.delimiter is None and preamble['delimiter'] is not None:
+            self.delimiter = str(preamble['delimiter'])
+        self.header_lines = [str(x) for x in preamble.get('header_lines', [])]
 
-        # genfromtxt returns a 1D array if there is only one data line.
-        # highly confusing behavior, numpy!
-        if len(_n.shape(z)) == 1: z = _n.array([z])
+        # store the header (repr() strings are always ascii)
+        for n in range(len(preamble['hkeys'])):
+            self.insert_header(str(preamble['hkeys'][n]), self._decode_header_value(str(preamble['headers'][n])))
+        if header_only: return self
 
-        # fix for different behavior of genfromtxt on single columns
-        if len(z.shape) == 2: z = z.transpose()
-        else:                 z = [z]
+        # map the columns straight from the file.
+        layout = preamble['columns']
+        raw    = None
+        if _os.path.getsize(path) > data_offset:
+            raw = _n.memmap(path, dtype=_n.uint8, mode='c', offset=data_offset)
 
-        # Add all the columns
+        self.ckeys = [str(k) for k in preamble['ckeys']]
         for n in range(len(self.ckeys)):
-
-            # if any of the imaginary components are non-zero, use complex
-            if _n.any(_n.imag(z[n])): self[n] = z[n]
-            else:                     self[n] = _n.real(z[n])
-
-        # now, as an added bonus, rename some of the obnoxious headers
-        for k in self.obnoxious_ckeys:
-            if self.columns.has_key(k):
-                self.columns[self.obnoxious_ckeys[k]] = self.columns[k]
+            dtype = _n.dtype(str(layout[n]['dtype']))
+            start = layout[n]['offset']
+            stop  = start + layout[n]['length']*dtype.itemsize
+            if start == stop: self.columns[self.ckeys[n]] = _n.zeros(0, dtype)
+            else:             self.columns[self.ckeys[n]] = raw[start:stop].view(dtype)
 
         return self
 
-    def save_file(self, path="ask", filters="*.dat", force_overwrite=False, header_only=False, delimiter='use current'):
+    def save_h5(self, path="ask", group=None, filters="*.h5", force_overwrite=False, compression='gzip', compression_level=4):
         """
-        This will save all the header info and columns to an ascii file with
-        the specified path.
-
-        filters="*.dat"         File filter for the file dialog (for path="ask")
-        force_overwrite=False   Normally, if the file * exists, this will copy that
-                                to *.backup. If the backup already exists, this
-                                function will abort. Setting this to True will
-                                force overwriting the backup file.
-        header_only=False       Only output the header?
-        delimiter="use current" This will set the delimiter of the output file
-                                "use current" means use self.delimiter
+        Saves the header and columns to an HDF5 file (needs the h5py module).
+        The headers are stored as attributes (repr() of each value) and each
+        column as a chunked, compressed dataset, so load_h5() can read just
+        part of a column without touching the rest of the file.
+
+        Many databoxes can live in the same file, one per group.
+
+        group=None              Name of the group to save into, e.g. 'sweep0001'
+                                (created if needed). None means the root of the
+                                file. Other groups in the file are left alone.
+        filters="*.h5"          File filter for the file dialog (for path="ask")
+        force_overwrite=False   If the group already holds a databox, this will
+                                abort unless this is True.
+        compression='gzip'      HDF5 filter for the columns ('gzip', 'lzf' or None)
+        compression_level=4     Level for the 'gzip' filter (0-9)
         """
+        if _h5py is None:
+            print "ERROR: save_h5() needs the h5py module."
+            return False
 
-        # This is the final path. We now write to a temporary file in the user
-        # directory, then move it to the destination. This (hopefully) fixes
-        # problems with sync programs.
         if path == "ask": path = _dialogs.save(filters, default_directory=self.directory)
         if path in ["", None]:
             print "Aborted."
             return False
 
-        # Save the path for future reference
-        self.path=path
+        # make sure all the columns can be stored as datasets
+        columns = []
+        for k in self.ckeys:
+            a = _n.asarray(self[k])
+            if not a.ndim == 1 or not a.dtype.kind in 'biufc':
+                print "ERROR: Column '"+str(k)+"' is not a 1-D numeric array and can't be saved in HDF5."
+                return False
+            if '/' in k or k == '.':
+                print "ERROR: Column '"+str(k)+"' can't be used as an HDF5 dataset name."
+                return False
+            columns.append(a)
+
+        f = _h5py.File(path, 'a')
+        try:
+            # get the group, getting rid of any databox already in there
+            g = f.require_group(group) if group is not None else f
+            if 'spinmob_ckeys' in g.attrs:
+                if not force_overwrite:
+                    print "ERROR: "+repr(path)+" already has a databox in group "+repr(group)+". Use force_overwrite=True to replace it."
+                    return False
+                for k in _json.loads(g.attrs['spinmob_ckeys']): del g[str(k)]
+                for k in _json.loads(g.attrs['spinmob_hkeys']): del g.attrs[str(k)]
+
+            # headers
+            for k in self.hkeys: g.attrs[k] = repr(self.headers[k])
+            g.attrs['spinmob_hkeys'] = _json.dumps(list(self.hkeys))
+            g.attrs['spinmob_ckeys'] = _json.dumps(list(self.ckeys))
+
+            # columns, resizable so they can be added to later
+            if compression == 'gzip': options = compression_level
+            else:                     options = None
+            for n in range(len(self.ckeys)):
+                g.create_dataset(self.ckeys[n], data=columns[n], chunks=True, maxshape=(None,),
+                                 compression=compression, compression_opts=options)
+        finally:
+            f.close()
 
-        # if the path exists, make a backup
-        if _os.path.exists(path) and not force_overwrite:
-            _os.rename(path,path+".backup")
+        self.path = path
+        return True
 
-        # get the delimiter
-        if delimiter == "use current":
-            if self.delimiter is None: delimiter = "\t"
-            else:                      delimiter = self.delimiter
+    def load_h5(self, path="ask", group=None, filters="*.h5", text="Select a file, FACEPANTS.", header_only=False, quiet=False, rows=None, lazy=False):
+        """
+        Loads a databox written by save_h5() (needs the h5py module).
+
+        group=None      Name of the group holding the databox (None means the
+                        root of the file). See spinmob.data.h5_groups().
+        rows=None       A slice (e.g. slice(1000,2000)) means only read those
+                        rows of each column. Only the chunks holding them are
+                        read and decompressed.
+        lazy=False      If True, each column is only read the first time it's
+                        used.
+        """
+        if _h5py is None:
+            if not quiet: print "ERROR: load_h5() needs the h5py module."
+            return None
 
-        # figure out the temporary path
-        temporary_path = _os.path.join(_s.settings.path_home, "temp-"+str(int(1e3*_time.time()))+'-'+str(int(1e9*_n.random.rand(1))))
-        
-        # open the file and write the header
-        f = open(temporary_path, 'w')
-        for k in self.hkeys: f.write(k + delimiter + repr(self.headers[k]) + "\n")
-        f.write('\n')
+        if path == "ask":
+            path = _dialogs.open_single(filters=filters,
+                                        default_directory=self.directory,
+                                        text=text)
+        self.path = path
 
-        # if we're only supposed to write the header
-        if header_only: return
+        if path is None:
+            if not quiet: print "Aborted."
+            return None
 
-        # now write the ckeys
-        elements = []
-        for ckey in self.ckeys: elements.append(str(ckey))
-        f.write(delimiter.join(elements) + "\n")
+        # read the headers and ckeys
+        f = _h5py.File(path, 'r')
+        try:
+            if group is not None and not group in f: attrs = dict()
+            else:                                    attrs = dict(_h5_group(f, group).attrs)
+        finally:
+            f.close()
 
-        # now loop over the data
-        for n in range(0, len(self[0])):
-            # loop over each column
-            elements = []
-            for m in range(0, len(self.ckeys)):
-                # write the data if there is any, otherwise, placeholder ("x")
-                if n < len(self[m]):
-                    elements.append(str(self[m][n]))
-                else:
-                    elements.append('_')
-            f.write(delimiter.join(elements) + "\n")
-            
-        f.close()
+        if not 'spinmob_ckeys' in attrs:
+            if not quiet: print "ERROR: "+repr(path)+" has no databox in group "+repr(group)+"."
+            return None
 
-        # now move it
-        _shutil.move(temporary_path, path)
+        # clear all the existing data
+        self.clear()
+
+        for k in _json.loads(attrs['spinmob_hkeys']):
+            self.insert_header(str(k), self._decode_header_value(str(attrs[k])))
+        if header_only: return self
+
+        # columns
+        ckeys  = [str(k) for k in _json.loads(attrs['spinmob_ckeys'])]
+        reader = _h5_reader(path, group, rows)
+        if lazy:
+            self.ckeys   = ckeys
+            self.columns = _lazy_columns(reader, ckeys)
+        else:
+            for k in ckeys: self[k] = reader(k)
 
+        return self
 
     def get_data_point(self, n):
         """
@@ -427,6 +1851,9 @@ class databox:
         elif len(self.columns)==0:
             for i in range(len(new_data)): self[i] = [new_data[i]]
 
+        # appending, so write into the spare room at the end of the columns
+        elif index is None and self._append_in_place(new_data): self._appends += 1
+
         # otherwise it matches length so just insert it.
         else:
             for i in range(len(new_data)):
@@ -438,6 +1865,9 @@ class databox:
                 if index is None: data.append(       new_data[i])
                 else:             data.insert(index, new_data[i])
 
+                # keep only the most recent points, like the ring buffers
+                if not self.max_points is None: data = data[max(len(data)-self.max_points, 0):]
+
                 # reconvert to an array
                 self[i] = _n.array(data)
 
@@ -445,10 +1875,105 @@ class databox:
         """
         Appends the supplied data point to the column(s).
 
+        Columns keep spare room at the end (doubling it when full), so this
+        is amortized O(1) and is fine to call once per step of a long sweep.
+
+        If self.max_points is not None, only the most recent max_points
+        data points are kept. Note that in this case arrays handed out
+        earlier see their data overwritten as new points arrive.
+
         new_data    a list or array of new data points, one for each column.
         """
         return self.insert_data_point(new_data)
 
+    def _append_in_place(self, new_data):
+        """
+        Appends new_data to the columns by writing into their spare room.
+        Columns living in the contiguous block are appended with a single
+        write. Returns False (changing nothing) if that isn't possible.
+        """
+        self._changed()
+
+        # ring buffers don't live in the contiguous block
+        if self._block is not None and not self.max_points is None: self._block = None
+
+        # columns that are still views of the contiguous block
+        blocked = []
+        if self._block is not None:
+            for n in range(len(self.ckeys)):
+                if self.columns[self.ckeys[n]] is self._block.views.get(self.ckeys[n]): blocked.append(n)
+            if not len(blocked) == len(self._block.rows): return False
+
+        if len(blocked):
+            ckeys = [self.ckeys[n] for n in blocked]
+            if not self._block.append(ckeys, [new_data[n] for n in blocked]): return False
+            for k in ckeys: self.columns[k] = self._block.views[k]
+
+        # everything else gets its own buffer
+        blocked = set(blocked)
+        for n in range(len(self.ckeys)):
+            if not n in blocked: self._append_to_column(self.ckeys[n], new_data[n])
+        return True
+
+    def _append_to_column(self, ckey, x):
+        """
+        Appends the value x to column ckey, using (or creating) a buffer with
+        spare room at the end. The column becomes a view of the buffer's
+        filled region, so arrays handed out earlier are unaffected.
+
+        self._buffers[ckey] is [buffer, view] (or [buffer, view, position]
+        for ring buffers; see _append_to_ring()).
+        """
+        a = self.columns[ckey]
+        x = _n.asarray(x)
+
+        # non-scalar entries get the old list treatment
+        if x.ndim: return self.insert_column(_n.array(list(a)+[x]), ckey)
+
+        # empty columns take on the type of the first value, like lists would
+        if len(a) == 0: dtype = x.dtype
+        else:           dtype = _n.promote_types(a.dtype, x.dtype)
+
+        # reuse the buffer only if the column is still the view we made of it
+        b = self._buffers.get(ckey)
+        if not self.max_points is None: return self._append_to_ring(ckey, a, x, dtype, b)
+        if b is None or len(b) > 2 or not a is b[1] or not b[0].dtype == dtype or len(a) == len(b[0]):
+            buffer = _n.empty(max(2*len(a), 16), dtype)
+            buffer[0:len(a)] = a
+        else:
+            buffer = b[0]
+
+        buffer[len(a)] = x
+        self.columns[ckey] = buffer[0:len(a)+1]
+        self._buffers[ckey] = [buffer, self.columns[ckey]]
+
+    def _append_to_ring(self, ckey, a, x, dtype, b):
+        """
+        Appends x to column ckey (currently the array a), keeping only the
+        most recent self.max_points points. The buffer holds two copies of the
+        ring back to back, so the time-ordered column is always a contiguous
+        view, and each append is just two writes.
+
+        b is the [buffer, view, next write position] for this column, or None.
+        """
+        N = self.max_points
+        if b is None or not a is b[1] or not b[0].dtype == dtype or not len(b[0]) == 2*N:
+            a = a[max(len(a)-N,0):]
+            buffer = _n.empty(2*N, dtype)
+            buffer[0:len(a)] = buffer[N:N+len(a)] = a
+            p = len(a) % N
+        else:
+            buffer, p = b[0], b[2]
+
+        # write the point into both copies and move the window
+        buffer[p] = buffer[p+N] = x
+        p = (p+1) % N
+        L = min(len(a)+1, N)
+        start = (p-L) % N
+
+        self.columns[ckey] = buffer[start:start+L]
+        self._buffers[ckey] = [buffer, self.columns[ckey], p]
+
     def execute_script(self, script, g={}):
         """
         Runs a script, returning the result.
@@ -469,6 +1994,9 @@ class databox:
         using insert_global(). Setting g=globals() will automatically insert
         your globals into this databox instance.
 
+        For big columns, set self.evaluator = 'fused' to evaluate the arithmetic
+        in a single pass without full-size temporary arrays (see _eval()).
+
         There are a few shorthand scripts available as well. You can simply type
         a column name such as "my_column" or a column number like 2. However, I
         only added this functionality as a shortcut, and something like
@@ -483,7 +2011,9 @@ class databox:
         """
 
         # add any extra user-supplied global variables for the eventual eval() call.
-        self.extra_globals.update(g)
+        if g:
+            self.extra_globals.update(g)
+            self._changed()
 
         # If the script is not a list of scripts, return the script value.
         # This is the termination of a recursive call.
@@ -500,12 +2030,20 @@ class databox:
                 print "ERROR: Could not parse '"+script+"'"
                 return None
 
+            # simple scripts have already been evaluated
+            if expression == '___': return v['___']
+
             # get all the numpy stuff too
             g = self._globals()
-            g.update(v)
+
+            # lambdas and generators can't see eval()'s locals, so those
+            # need the variables in (a copy of) the globals
+            if _has_nested_scopes(expression):
+                g = dict(g)
+                g.update(v)
 
             # otherwise, evaluate the script using python's eval command
-            return eval(expression, g)
+            return self._eval(script, expression, g, v)
 
         # Otherwise, this is a list of (lists of) scripts. Make the recursive call.
         output = []
@@ -516,10 +2054,29 @@ class databox:
     # Define this so you can quickly call a script
     __call__ = execute_script
 
+    def _eval(self, script, code, g, v=None):
+        """
+        Evaluates the compiled expression code of the script text (see
+        _compile_script()) with globals g and locals v.
+
+        If self.evaluator is 'fused', the arithmetic is evaluated in a single
+        pass over the data (with numexpr if it's installed, otherwise with numpy
+        a block at a time), avoiding a full-size temporary array for every
+        operation. Anything it can't handle goes to eval().
+        """
+        if self.evaluator == 'fused' and isinstance(script, basestring):
+            fused = _compile_script(script)[3]
+            if fused is not None:
+                try:    return fused(g, v)
+                except _fused.Unfusable: pass
+
+        return eval(code, g, v)
+
     def _parse_script(self, script, n=0):
         """
         This takes a script such as "a/b where a=c('current'), b=3.3" and returns
-        ["a/b", {"a":self.columns["current"], "b":3.3}]
+        ["a/b", {"a":self.columns["current"], "b":3.3}], where "a/b" is
+        compiled (and cached; see _compile_script()).
 
         You can also just use an integer for script to reference columns by number
         or use the column label as the script.
@@ -543,8 +2100,9 @@ class databox:
         # the scripts would like to use calls like "h('this')/3.0*c('that')",
         # so to make eval() work we should add these functions to a local list
 
-        # first split up by "where"
-        split_script = script.split(" where ")
+        # get the (cached) expression, its compiled code, and the variables
+        [expression, code, variables, fused] = _compile_script(script)
+        if code is None: code = expression
 
 
         ########################################
@@ -552,7 +2110,7 @@ class databox:
         ########################################
 
         # if it's a simple script, like "column0" or "c(3)/2.0"
-        if len(split_script) is 1:
+        if variables is None:
             if self.debug: print "script of length 1"
 
             # try to evaluate the script
@@ -567,7 +2125,7 @@ class databox:
 
             # Otherwise, evaluate it.
             try:
-                b = eval(script, self._globals())
+                b = self._eval(script, code, self._globals())
                 return ['___', {'___':b}]
             except:
                 print
@@ -581,26 +2139,18 @@ class databox:
 
         # otherwise it's a complicated script like "c(1)-a/2 where a=h('this')"
 
-        # tidy up the expression
-        expression = split_script[0].strip()
-
-        # now split the variables list up by ,
-        varsplit = split_script[1].split(';')
-
         # loop over the entries in the list of variables, storing the results
         # of evaluation in the "stuff" dictionary
         stuff = dict()
-        for var in varsplit:
+        for var in variables:
 
-            # split each entry by the "=" sign
-            s = var.split("=")
-            if len(s) == 1:
-                print s, "has no '=' in it"
+            # clauses without an "=" sign
+            if len(var) == 1:
+                print var, "has no '=' in it"
                 return [None, None]
 
             # tidy up into "variable" and "column label"
-            v = s[0].strip()
-            c = s[1].strip()
+            [v, c] = var
 
             # now try to evaluate c, given our current globbies
 
@@ -615,7 +2165,7 @@ class databox:
             stuff[v] = y[x]
 
         # at this point we've found or generated the list
-        return [expression, stuff]
+        return [code, stuff]
 
 
 
@@ -650,6 +2200,7 @@ class databox:
 
         if name is None: name=thing.__name__
         self.extra_globals[name] = thing
+        self._changed()
 
     def insert_header(self, hkey, value, index=None):
         """
@@ -663,6 +2214,7 @@ class databox:
         if type(hkey) in [int, long]: hkey = self.hkeys[hkey]
 
         # set the data
+        self._changed()
         self.headers[str(hkey)] = value
         if not hkey in self.hkeys:
             if index is None: self.hkeys.append(str(hkey))
@@ -674,6 +2226,7 @@ class databox:
 
         You can specify either a key string or an index.
         """
+        self._changed()
 
         # try the integer approach first to allow negative values
         if type(hkey) is not str:
@@ -699,7 +2252,7 @@ class databox:
 
         # try the integer approach first to allow negative values
         if type(ckey) is not str:
-            return self.columns.pop(self.ckeys.pop(ckey))
+            return self._remove_column(self.ckeys.pop(ckey))
         else:
             # find the key integer and pop it
             ckey = self.ckeys.index(ckey)
@@ -710,7 +2263,7 @@ class databox:
                 return
 
             # pop it!
-            return self.columns.pop(self.ckeys.pop(ckey))
+            return self._remove_column(self.ckeys.pop(ckey))
 
     def insert_column(self, data_array, ckey='temp', index=None):
         """
@@ -726,11 +2279,66 @@ class databox:
         if type(ckey) in [int, long]: ckey = self.ckeys[ckey]
 
         # append/overwrite the column value
-        self.columns[ckey] = _n.array(data_array)
+        self._changed()
+        self._edits += 1
+        self._buffers.pop(ckey, None)
+        if self.storage == 'block': self.columns[ckey] = self._block_column(ckey, data_array)
+        else:                       self.columns[ckey] = _n.array(data_array)
         if not ckey in self.ckeys:
             if index is None: self.ckeys.append(ckey)
             else:             self.ckeys.insert(index, ckey)
 
+    def _block_column(self, ckey, data_array):
+        """
+        Stores data_array in the contiguous column block if it matches the
+        block's length and dtype, returning a zero-copy view. Otherwise the
+        column is removed from the block and an independent copy is returned.
+        """
+        a = _n.asarray(data_array)
+
+        # start a new block if there isn't one, or this is the only column in
+        # it and doesn't fit (an empty block preallocated by load_file() gets used)
+        if self._block is None or (not len(set(self._block.rows)-set([ckey])) and not self._block.accepts(a)):
+            if a.ndim == 1 and a.dtype.kind in 'biufc':
+                self._block = _column_block(len(a), a.dtype)
+
+        # if it fits, put it in the block
+        if self._block is not None and self._block.accepts(a):
+
+            # if the block was reallocated, all the views need updating
+            if self._block.set(ckey, a):
+                for k in self._block.rows: self.columns[k] = self._block.views[k]
+
+            return self._block.views[ckey]
+
+        # otherwise it has diverged from the block
+        if self._block is not None: self._block.remove(ckey)
+        return _n.array(data_array)
+
+    def _remove_column(self, ckey):
+        """
+        Removes and returns the data for ckey from self.columns, making sure the
+        returned array doesn't share memory with the contiguous block.
+        """
+        data = self.columns.pop(ckey)
+        self._changed()
+        self._edits += 1
+        self._buffers.pop(ckey, None)
+        if self._block is not None and ckey in self._block.rows:
+            self._block.remove(ckey)
+            data = _n.array(data)
+        return data
+
+    def _block_has_all_columns(self):
+        """
+        Returns True if every column is currently a view into the contiguous
+        block (i.e. nobody has replaced self.columns entries behind our back).
+        """
+        if self._block is None or not len(self.ckeys): return False
+        for k in self.ckeys:
+            if not self.columns.get(k) is self._block.views.get(k): return False
+        return True
+
     def append_column(self, data_array, ckey='temp'):
         """
         This will append a new column and fill it with the data from the
@@ -753,16 +2361,22 @@ class databox:
         """
         This will remove all the ckeys and columns.
         """
-        self.ckeys   = []
-        self.columns = {}
+        self.ckeys     = []
+        self.columns   = {}
+        self._block    = None
+        self._buffers  = {}
+        self._appended = None
+        self._edits   += 1
+        self._changed()
 
 
     def clear_headers(self):
         """
         This will remove all the hkeys and headers
         """
-        self.hkeys    = []
+        self.hkeys    = _key_list()
         self.headers  = {}
+        self._changed()
 
     def clear(self):
         """
@@ -777,6 +2391,7 @@ class databox:
         """
         self.hkeys[self.hkeys.index(old_name)] = new_name
         self.headers[new_name] = self.headers.pop(old_name)
+        self._changed()
 
     def rename_column(self, column, new_name):
         """
@@ -786,8 +2401,11 @@ class databox:
         if type(column) is not str: column = self.ckeys[column]
         self.ckeys[self.ckeys.index(column)] = new_name
         self.columns[new_name] = self.columns.pop(column)
+        if self._block is not None: self._block.rename(column, new_name)
+        if column in self._buffers: self._buffers[new_name] = self._buffers.pop(column)
+        self._changed()
 
-    def trim(self, *conditions):
+    def trim(self, *conditions, **kwargs):
         """
         Removes data points not satisfying the supplied conditions. Conditions
         can be truth arrays (having the same length as the columns!)
@@ -799,24 +2417,87 @@ class databox:
 
         Note this will not modify the databox, rather it will generate a new
         one with the same header information and return it.
+
+        The masks from scripted conditions are remembered until this databox's
+        columns, headers or globals change (through its methods; writing
+        into the column arrays directly isn't noticed), so repeating a trim
+        is cheap.
+
+        view=False      If True, the new databox's columns aren't copied
+                        until they're used. If the kept data points are
+                        contiguous, its columns are read-only views of this
+                        databox's columns (setting a column replaces the view
+                        with the new data, as usual).
         """
         conditions = list(conditions)
 
-        # if necessary, evaluate string scripts
-        for n in range(len(conditions)):
-            if type(conditions[n]) is str:
-                conditions[n] = self.execute_script(conditions[n])
-
         # make a new databox with the same options and headers
-        new_databox = databox(delimiter=self.delimiter)
+        new_databox = databox(delimiter=self.delimiter, storage=self.storage)
         new_databox.copy_headers(self)
 
+        # indices of the data points to keep (None means all of them)
+        ns = self._trim_indices(conditions)
+
+        # view mode: only index the columns when they're asked for
+        if kwargs.get('view', False):
+            if   ns is None:                               index = slice(None)
+            elif len(ns) == 0:                             index = slice(0,0)
+            elif ns[-1]-ns[0]+1 == len(ns):                index = slice(ns[0], ns[-1]+1)
+            else:                                          index = ns
+
+            columns = dict([(k, self.columns[k]) for k in self.ckeys])
+            new_databox.ckeys   = list(self.ckeys)
+            new_databox.columns = _lazy_columns(_column_view(columns, index), self.ckeys)
+            return new_databox
+
+        # contiguous storage: trim all the columns with one fancy index
+        if ns is not None and self._block_has_all_columns():
+            new_databox._block = self._block.take(self.ckeys, ns)
+            new_databox.ckeys  = list(self.ckeys)
+            for k in self.ckeys: new_databox.columns[k] = new_databox._block.views[k]
+            return new_databox
+
         # trim it up, send it out.
-        cs = _s.fun.trim_data_uber(self, conditions)
-        for n in range(len(cs)): new_databox.append_column(cs[n], self.ckeys[n])
+        for n in range(len(self.ckeys)):
+            if ns is None: new_databox.append_column(self[n],     self.ckeys[n])
+            else:          new_databox.append_column(self[n][ns], self.ckeys[n])
 
         return new_databox
 
+    def _trim_indices(self, conditions):
+        """
+        Returns the indices of the data points satisfying all the conditions
+        (see trim()), or None if there are no conditions. Masks of scripted
+        conditions, and the indices for a list of them, are kept in self._masks.
+        """
+        if not len(conditions): return None
+
+        # forgets the masks if self.extra_globals was changed by hand
+        self._globals()
+
+        # a whole set of scripts we've seen before
+        key = None
+        if not False in [type(c) is str for c in conditions]:
+            key = tuple(conditions)
+            if key in self._masks: return self._masks[key]
+
+        # if necessary, evaluate string scripts
+        masks = []
+        for c in conditions:
+            if type(c) is str:
+                if not c in self._masks: self._masks[c] = self.execute_script(c)
+                masks.append(self._masks[c])
+            else:
+                masks.append(c)
+
+        # find the indices to keep
+        all_conditions = masks[0]
+        for n in range(1,len(masks)): all_conditions = all_conditions & masks[n]
+        ns = _n.argwhere(all_conditions).transpose()[0]
+
+        if key is not None: self._masks[key] = ns
+        return ns
+
 
     def update_headers(self, dictionary, keys=None):
         """
@@ -836,7 +2517,7 @@ class databox:
         Returns the n'th column if it's an integer, otherwise the column based
         on key.
         """
-        if len(self.columns) == 0:   return []
+        if len(self.ckeys)   == 0:   return []
         if type(n)           is str: return self.columns[n]
         else:                        return self.columns[self.ckeys[n]]
 
@@ -867,11 +2548,11 @@ class databox:
             # if this is an exact match
             elif hkey in self.hkeys:      return self.headers[hkey]
 
-            # Look for a fragment.
+            # Look for a fragment (the first key containing it wins).
             else:
-                for k in self.hkeys:
-                    if k.find(hkey) >= 0:
-                        return self.headers[k]
+                if not isinstance(self.hkeys, _key_list): self.hkeys = _key_list(self.hkeys)
+                k = self.hkeys.find(hkey)
+                if k is not None: return self.headers[k]
                 print
                 print "ERROR: Couldn't find '"+str(hkey) + "' in header."
                 print "Possible values:"
@@ -893,6 +2574,7 @@ class fitter():
 
     _f_raw  = None # raw argument passed to set_functions()
     _bg_raw = None # raw argument passed to set_functions()
+    _g_raw  = None # raw globals passed to __init__()
 
     _set_xdata  = None # definitions from which data is derived during fits
     _set_ydata  = None
@@ -903,6 +2585,13 @@ class fitter():
     _ydata_massaged  = None
     _eydata_massaged = None
 
+    _data_serial      = 0    # incremented by everything that changes the set_data() inputs
+    _functions_serial = 0    # incremented by _update_functions()
+    _script_names     = None # names used by the data scripts (None means unknown)
+    _data_key         = None # what the cached get_data() result depends on
+    _data_cache       = None # [xdata, ydata, eydata] from get_data()
+    _massaged_key     = None # what the massaged data depends on
+
     _settings = None   # dictionary containing all the fitter settings
 
     results = None  # full output from the fitter.
@@ -937,11 +2626,15 @@ class fitter():
             the error from the data itself.
         """
 
-        # make sure all the awesome stuff from numpy is visible.
-        self._globals  = _n.__dict__
+        # make sure all the awesome stuff from numpy is visible. These are
+        # our own copies, so the constants (which live in here) don't end up
+        # in numpy itself or in other fitters.
+        self._globals          = dict(_n.__dict__)
+        self._set_data_globals = dict(_n.__dict__)
 
         # update the globals dictionary
         if not g is None: self._globals.update(g)
+        self._g_raw = g
 
         self._pnames    = []
         self._cnames    = []
@@ -950,6 +2643,10 @@ class fitter():
         self._pguess    = []
         self._constants = []
 
+        # number of times the data scripts were run, and the data was
+        # actually recomputed by get_data() and _massage_data()
+        self.counters = dict(scripts=0, get_data=0, massage_data=0)
+
         # default settings
         self._settings = dict(autoplot      = True,     # whether we always plot when changing stuff
                               plot_fit      = True,     # include f in plots?
@@ -970,6 +2667,8 @@ class fitter():
                               yscale        = 'linear', # axis scale type
                               scale_eydata  = 1.0,      # by how much should we scale the eydata?
                               coarsen       = 1,        # how much to coarsen the data
+                              evaluator     = 'eval',   # 'fused' evaluates string function arithmetic in one pass (see _fused.py)
+                              jacobian      = 'analytic', # 'analytic' fits with derivatives of the string functions (when possible), 'numerical' with finite differences
 
                               # styles of plots
                               style_data   = dict(marker='+', color='b',   ls=''),
@@ -988,7 +2687,7 @@ class fitter():
                                    'xlabel', 'ylabel'])
 
         # settings that should not be lists in general (i.e. not one per data set)
-        self._single_settings = list(['autoplot', 'first_figure'])
+        self._single_settings = list(['autoplot', 'first_figure', 'evaluator', 'jacobian'])
 
         # set the functions
         self.set_functions(f, p, c, bg)
@@ -1016,14 +2715,17 @@ class fitter():
         # special case: setting a _pguess
         if key in self._pnames: self._pguess[self._pnames.index(key)] = value
 
-        # special case: setting a _constants
+        # special case: setting a _constants (the functions look these up
+        # in self._globals, so there's no need to rebuild them)
         elif key in self._cnames:
             self._constants[self._cnames.index(key)] = value
-            self._update_functions()
+            self._globals[key] = value
 
         # special case: single-valued keys
         elif key in self._single_settings:
+            changed = not self._settings.get(key) == value
             self._settings[key] = value
+            if key == 'evaluator' and changed: self._update_functions()
 
         # everything else should have a value for each data set or plot
         elif self._settings.has_key(key):
@@ -1192,6 +2894,8 @@ class fitter():
         self.bg     = []
         self._fnames  = []
         self._bgnames = []
+        self._df      = []
+        self._functions_serial += 1
 
         f  = self._f_raw
         bg = self._bg_raw
@@ -1205,9 +2909,8 @@ class fitter():
         pstring = ', '.join(self._pnames)
         pstring = 'x, ' + pstring
 
-        # update the globals for the functions
-        # the way this is done, we must redefine the functions
-        # every time we change a constant
+        # update the globals for the functions (later changes to the
+        # constants just change these values)
         for cname in self._cnames: self._globals[cname] = self[cname]
 
         # loop over all the functions and create the master list
@@ -1215,15 +2918,18 @@ class fitter():
 
             # if f[n] is a string, define a function on the fly.
             if isinstance(f[n], str):
-                self.f.append( eval('lambda ' + pstring + ': ' + f[n],  self._globals))
+                self.f.append(self._string_function(f[n], pstring))
                 self._fnames.append(f[n])
             else:
                 self.f.append(f[n])
                 self._fnames.append(f[n].__name__)
 
+            # and its derivatives with respect to each parameter, if we can
+            self._df.append(self._derivative_functions(f[n], pstring))
+
             # if bg[n] is a string, define a function on the fly.
             if isinstance(bg[n], str):
-                self.bg.append(eval('lambda ' + pstring + ': ' + bg[n], self._globals))
+                self.bg.append(self._string_function(bg[n], pstring))
                 self._bgnames.append(bg[n])
             else:
                 self.bg.append(bg[n])
@@ -1236,6 +2942,39 @@ class fitter():
         # make sure we don't think our fit results are valid!
         self.clear_results()
 
+    def _string_function(self, f, pstring):
+        """
+        Returns a function of the arguments in pstring (e.g. 'x, a, b')
+        evaluating the string function f. If the 'evaluator' setting is
+        'fused', the arithmetic is evaluated in one pass over the data,
+        falling back to the plain function for anything else.
+        """
+        function = eval('lambda ' + pstring + ': ' + f, self._globals)
+        fused    = _fused.compile_expression(f)
+        if not self._settings.get('evaluator') == 'fused' or fused is None: return function
+
+        names    = [s.strip() for s in pstring.split(',')]
+        globbies = self._globals
+
+        def fused_function(*args):
+            try:    return fused(globbies, dict(zip(names, args)))
+            except _fused.Unfusable: return function(*args)
+
+        return fused_function
+
+    def _derivative_functions(self, f, pstring):
+        """
+        Returns a list of functions (of the arguments in pstring) giving the
+        partial derivatives of the string function f with respect to each
+        parameter, or None if f isn't a string or can't be differentiated.
+        """
+        if not isinstance(f, str): return None
+
+        try:    derivatives = [_derivatives.derivative(f, p, self._globals) for p in self._pnames]
+        except _derivatives.NotDifferentiable: return None
+
+        return [self._string_function(d, pstring) for d in derivatives]
+
 
     def set_data(self, xdata=[1,2,3,4,5], ydata=[[1,2,1,2,1],[3,2,3,4,3]], eydata=None, **kwargs):
         """
@@ -1327,6 +3066,10 @@ class fitter():
         self._set_eydata = eydata
         self._set_data_globals.update(kwargs)
 
+        # forget the cached data
+        self._data_serial += 1
+        self._script_names = _script_names(list(xdata)+list(ydata)+list(eydata))
+
         # set the eyscale to 1 for each data set
         self['scale_eydata'] = [1.0]*len(self._set_xdata)
 
@@ -1360,12 +3103,19 @@ class fitter():
 
         kwargs are added to globals for script evaluation.
         """
-        self._set_data_globals.update(kwargs)
+        if len(kwargs):
+            self._set_data_globals.update(kwargs)
+            self._data_serial += 1
         return eval(script, self._set_data_globals)
 
     def get_data(self):
         """
         Returns current xdata, ydata, eydata, after set_data() has been run.
+
+        The result is cached, and only recomputed (rerunning the scripts)
+        after set_data(), or when scale_eydata or a parameter / constant used
+        by the scripts changes. If you change the supplied arrays in place,
+        call set_data() again. Don't modify the returned arrays.
         """
         # make sure we've done a "set data" call
         if self._set_xdata is None or self._set_ydata is None:
@@ -1381,6 +3131,15 @@ class fitter():
         self._set_data_globals['bg']   = self.bg
         self._set_data_globals['self'] = self
 
+        # if nothing the data depends on has changed, use the last result
+        key = self._get_data_key()
+        if key is not None and key == self._data_key:
+            xdata, ydata, eydata = self._data_cache
+            self._set_data_globals['x'] = xdata
+            self._set_data_globals['y'] = ydata
+            return list(xdata), list(ydata), list(eydata)
+        self.counters['get_data'] += 1
+
         # possibilities after calling set_data():
         # xdata and ydata   ['script','script'], [[1,2,3],[1,2,3]], [[1,2,3],'script'], ['script', [1,2,3]]
         # eydata            ['script','script'], [[1,1,1],[1,1,1]], [[1,1,1],'script'], ['script', [1,1,1]], [3,3], [3,[1,2,3]], [None,None]
@@ -1394,7 +3153,7 @@ class fitter():
         for n in range(len(xdata)):
 
             # For xdata, handle scripts or arrays
-            if type(xdata[n]) is str: xdata[n] = self.evaluate_script(xdata[n])
+            if type(xdata[n]) is str: xdata[n] = self._evaluate_data_script(xdata[n])
             else:                     xdata[n] = _n.array(xdata[n])*1.0
 
         # update the globals
@@ -1404,7 +3163,7 @@ class fitter():
         for n in range(len(ydata)):
 
             # For ydata, handle scripts or arrays
-            if type(ydata[n]) is str: ydata[n] = self.evaluate_script(ydata[n])
+            if type(ydata[n]) is str: ydata[n] = self._evaluate_data_script(ydata[n])
             else:                     ydata[n] = _n.array(ydata[n])*1.0
 
         # update the globals
@@ -1415,7 +3174,7 @@ class fitter():
 
             # handle scripts
             if type(eydata[n]) is str:
-                eydata[n] = self.evaluate_script(eydata[n])
+                eydata[n] = self._evaluate_data_script(eydata[n])
 
             # handle None (possibly returned by script): take a visually-appealing guess at the error
             if eydata[n] is None:
@@ -1428,9 +3187,39 @@ class fitter():
             # make it an array
             eydata[n] = _n.array(eydata[n]) * self["scale_eydata"][n]
 
+        # remember it for next time
+        self._data_key   = key
+        self._data_cache = [list(xdata), list(ydata), list(eydata)]
+
         # return it
         return xdata, ydata, eydata
 
+    def _evaluate_data_script(self, script):
+        """
+        Runs one of the set_data() scripts for get_data(), counting it.
+        """
+        self.counters['scripts'] += 1
+        return eval(script, self._set_data_globals)
+
+    def _get_data_key(self):
+        """
+        Returns something that changes whenever the result of get_data()
+        could (or None if we can't tell).
+        """
+        names = self._script_names
+        if names is None: return None
+
+        key = [self._data_serial, list(self['scale_eydata'])]
+        if 'f' in names or 'bg' in names: key.append(self._functions_serial)
+
+        # the parameters and constants the scripts use
+        for n in range(len(self._pnames)):
+            if self._pnames[n] in names: key.append(self._pguess[n])
+        for n in range(len(self._cnames)):
+            if self._cnames[n] in names: key.append(self._constants[n])
+
+        return key
+
     def set_guess_to_fit_result(self):
         """
         If you have a fit result, set the guess parameters to the
@@ -1456,12 +3245,18 @@ class fitter():
             ymin    = None  # can be a number
             ymax    = None  # can be a number
 
-        Results are stored in self._xdata_massaged, ...
+        Results are stored in self._xdata_massaged, ... and only recomputed
+        when the data or these settings change.
         """
 
         # get the data
         xdata, ydata, eydata = self.get_data()
 
+        # nothing to do if neither the data nor the trimming has changed
+        key = [self._data_key, repr([self['xmin'], self['xmax'], self['ymin'], self['ymax'], self['coarsen']])]
+        if key[0] is not None and key == self._massaged_key: return
+        self.counters['massage_data'] += 1
+
         self._xdata_massaged  = []
         self._ydata_massaged  = []
         self._eydata_massaged = []
@@ -1472,11 +3267,16 @@ class fitter():
         ymins = self['ymin']
         ymaxs = self['ymax']
 
-        # make sure we have one limit for each data set
+        # make sure we have one limit for each data set (copies, so the
+        # None's below don't get overwritten in the settings)
         if type(xmins) is not list: xmins = [xmins]*len(xdata)
+        else:                       xmins = list(xmins)
         if type(xmaxs) is not list: xmaxs = [xmaxs]*len(xdata)
+        else:                       xmaxs = list(xmaxs)
         if type(ymins) is not list: ymins = [ymins]*len(xdata)
+        else:                       ymins = list(ymins)
         if type(ymaxs) is not list: ymaxs = [ymaxs]*len(xdata)
+        else:                       ymaxs = list(ymaxs)
 
         # this should cover all the data sets (dimensions should match!)
         for n in range(len(xdata)):
@@ -1508,6 +3308,8 @@ class fitter():
             self. _ydata_massaged.append(y)
             self._eydata_massaged.append(ey)
 
+        self._massaged_key = key
+
 
 
     def fit(self, pguess=None, method='leastsq', **kwargs):
@@ -1517,6 +3319,11 @@ class fitter():
 
         pguess        If None, this will set the internal guess values
 
+        If all the functions are strings built from arithmetic and numpy
+        functions, leastsq gets their analytic derivatives, so it doesn't
+        have to evaluate them len(p)+1 times for each jacobian (see the
+        'jacobian' setting).
+
         results of the fit are stored in self.results
 
         kwargs are sent to self.set()
@@ -1536,13 +3343,281 @@ class fitter():
         if pguess is not None: self._pguess = pguess
 
         # do the actual optimization
-        self.results = _opt.leastsq(self._studentized_residuals_concatenated, self._pguess, full_output=1)
+        self.results = self._leastsq(self._pguess)
 
         # plot if necessary
         if self['autoplot']: self.plot()
 
         return self
 
+    def _leastsq(self, pguess):
+        """
+        Runs leastsq() on the massaged data starting from pguess, with the
+        analytic jacobian if we have one. Returns the full leastsq() output.
+
+        The derivatives can be nan or inf where the function itself is fine
+        (e.g. x**a at x=0), which would quietly stop leastsq() at the guess,
+        so then the fit starts over with finite differences.
+        """
+        if self['jacobian'] == 'analytic' and not None in self._df:
+            def jacobian(p):
+                J = self._studentized_residuals_jacobian(p)
+                if not _n.isfinite(J).all(): raise _derivatives.NotDifferentiable("nan's or inf's in the jacobian")
+                return J
+
+            try:    return _opt.leastsq(self._studentized_residuals_concatenated, pguess, full_output=1,
+                                        Dfun=jacobian, col_deriv=1)
+            except _derivatives.NotDifferentiable: pass
+
+        return _opt.leastsq(self._studentized_residuals_concatenated, pguess, full_output=1)
+
+    def fit_many(self, xdata, ydata, eydata, pguess=None, workers=1, chunksize=None, method='leastsq'):
+        """
+        Fits the (single) function to each of a whole stack of data sets, e.g.
+        one trace per field point, and returns the arrays
+
+            p, ep, reduced_chi_squareds, failures
+
+        where p[k] and ep[k] are the fit parameters and their errors for data
+        set k (nan for failed fits), and failures is a dictionary of
+        {k: error message} for the fits that didn't work. A failed fit does
+        not stop the others.
+
+        The data sets are fit as they are (xmin, coarsen etc are ignored), and
+        this fitter's own data and results are left alone.
+
+        xdata       One array (used for every data set) or a list of arrays
+        ydata       List (or 2-d array) of data sets
+        eydata      Error bars: a number, one array, or a list of them
+        pguess=None Starting parameters; None means the current guess. Can
+                    also be a list of guesses, one per data set.
+        workers=1   Number of processes doing the fits (None means one per
+                    cpu). The model is only compiled once per process. With
+                    more than one worker, python function models (and
+                    anything in the globals g) must be defined at module
+                    level, and on Windows your script needs the usual
+                    "if __name__ == '__main__':" guard.
+        chunksize=None  Number of data sets sent to a worker at a time. None
+                    means enough for about four chunks per worker.
+        method='leastsq'  'leastsq' fits each data set separately with
+                    scipy's leastsq. 'lm' advances all the fits in a chunk
+                    together with a vectorized Levenberg-Marquardt (see
+                    _fit_chunk_lm()), which is much faster for lots of small
+                    fits. It needs data sets of the same length, and a
+                    function that works on 2-d arrays (string functions do).
+        """
+        if not len(self.f) == 1:
+            return self._error("fit_many() needs a fitter with exactly one function.")
+        if eydata is None:
+            return self._error("fit_many() needs error bars.")
+
+        # one array for everyone?
+        K = len(ydata)
+        if   _s.fun.is_a_number(xdata[0]):  xdata  = [xdata]*K
+        if   _s.fun.is_a_number(eydata):    eydata = [eydata]*K
+        elif _s.fun.is_a_number(eydata[0]): eydata = [eydata]*K
+
+        if pguess is None: pguess = self._pguess
+        if _s.fun.is_a_number(pguess[0]): pguess = [pguess]*K
+
+        if not len(xdata) == K or not len(eydata) == K or not len(pguess) == K:
+            return self._error("fit_many() needs the same number of xdata, ydata, eydata and pguess.")
+
+        # everything needed to rebuild this model (without its globals)
+        f = self._f_raw
+        if _s.fun.is_iterable(f): f = f[0]
+        spec = (f, ', '.join(self._pnames),
+                ', '.join([self._cnames[n]+'='+repr(self._constants[n]) for n in range(len(self._cnames))]) or None,
+                self['evaluator'], self['jacobian'])
+
+        # chop the data sets into chunks
+        if workers is None: workers = _multiprocessing.cpu_count()
+        if chunksize is None: chunksize = max(1, int(_n.ceil(K/(4.0*workers))))
+        chunks = []
+        for i in range(0, K, chunksize):
+            ks = range(i, min(i+chunksize, K))
+            chunks.append((method, ks, [xdata[k] for k in ks], [ydata[k] for k in ks], [eydata[k] for k in ks], [pguess[k] for k in ks]))
+
+        # do the fits here, with our own globals (a fresh fitter, so our data
+        # and results are left alone)
+        if workers == 1 or len(chunks) < 2:
+            f, p, c, evaluator, jacobian = spec
+            fitter_ = fitter(f, p, c, g=self._g_raw, autoplot=False, silent=True, evaluator=evaluator, jacobian=jacobian)
+            results = [_fit_many_chunk(fitter_, *chunk) for chunk in chunks]
+
+        # or in other processes, which need the globals sent over
+        else:
+            gs = None
+            if self._g_raw:
+                try:    gs = _pickle.dumps(self._g_raw, 2)
+                except Exception as e:
+                    return self._error("fit_many() can't send the globals g to other processes ("+str(e)+"). Use module-level functions or workers=1.")
+
+            pool = _multiprocessing.Pool(workers)
+            try:
+                results = pool.map(_fit_many_worker, [(spec+(gs,),)+chunk for chunk in chunks])
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+
+        # collect the results
+        P        = len(self._pnames)
+        p        = _n.nan*_n.ones((K, P))
+        ep       = _n.nan*_n.ones((K, P))
+        rchi2    = _n.nan*_n.ones(K)
+        failures = dict()
+        for chunk in results:
+            for k, pk, epk, rk, error in chunk:
+                if error is None: p[k], ep[k], rchi2[k] = pk, epk, rk
+                else:             failures[k] = error
+
+        return p, ep, rchi2, failures
+
+    def _fit_one(self, x, y, ey, pguess):
+        """
+        Fits a single data set for fit_many(), without touching the settings.
+        Returns the parameters, their errors and the reduced chi squared.
+        Raises an exception if the fit fails.
+        """
+        self._xdata_massaged  = [_n.array(x, dtype=float)]
+        self._ydata_massaged  = [_n.array(y, dtype=float)]
+        self._eydata_massaged = [_n.absolute(_n.array(ey, dtype=float))*_n.ones(len(self._xdata_massaged[0]))]
+
+        if not len(self._xdata_massaged[0]) == len(self._ydata_massaged[0]):
+            raise ValueError("xdata and ydata have different lengths.")
+        if (self._eydata_massaged[0]==0).any():
+            raise ValueError("One or more of the error bars is zero.")
+        if not (_n.isfinite(self._ydata_massaged[0]).all() and _n.isfinite(self._eydata_massaged[0]).all()):
+            raise ValueError("The data has nan's or inf's in it.")
+
+        p, covariance, info, message, ier = self._leastsq(_n.array(pguess, dtype=float))
+        if not ier in [1,2,3,4]:  raise RuntimeError(message)
+        if covariance is None:    raise RuntimeError("Singular covariance matrix (a parameter has no effect?).")
+
+        # same error scaling as everyone else uses: just the covariance
+        p = _n.atleast_1d(p)
+        return p, _n.sqrt(_n.diag(covariance)), self.reduced_chi_squareds(p)[0]
+
+    def _fit_chunk_lm(self, xs, ys, eys, pguesses, iterations=200, ftol=1.49012e-8, xtol=1.49012e-8):
+        """
+        Levenberg-Marquardt on a whole stack of K equal-length data sets at
+        once, for fit_many(method='lm'). The function and its derivatives are
+        evaluated on (K, N) arrays with each parameter a (K, 1) column, so a
+        step costs the same few numpy calls no matter how many fits there
+        are. Each fit has its own damping, and drops out when it converges
+        (same ftol and xtol as leastsq). Fits with nan's or inf's at the
+        guess, or that no step improves, are failures.
+
+        Returns the arrays p, ep, reduced chi squareds, and a dictionary of
+        {index in the stack: error message} for the fits that failed.
+        """
+        Y  = _n.array(ys, dtype=float)
+        if not Y.ndim == 2: raise ValueError("method='lm' needs data sets of the same length.")
+        K, N = Y.shape
+
+        X  = _n.array([_n.array(x, dtype=float)*_n.ones(N) for x in xs])
+        EY = _n.array([_n.absolute(_n.array(e, dtype=float))*_n.ones(N) for e in eys])
+        p  = _n.array(pguesses, dtype=float)
+        P    = p.shape[1]
+
+        def residuals(p, rows):
+            return (Y[rows] - self.f[0](X[rows], *[p[:,[m]] for m in range(P)])) / EY[rows]
+
+        def differences(p, rows, r):
+            J = _n.empty((len(rows), P, N))
+            for m in range(P):
+                h = 1.49012e-8*_n.absolute(p[:,[m]]); h[h==0] = 1.49012e-8
+                q = p.copy(); q[:,[m]] += h
+                J[:,m,:] = (residuals(q, rows) - r)/h
+            return J
+
+        def jacobian(p, rows, r):
+            if None in self._df: return differences(p, rows, r)
+            J = _n.empty((len(rows), P, N))
+            for m in range(P):
+                J[:,m,:] = -self._df[0][m](X[rows], *[p[:,[n]] for n in range(P)]) / EY[rows]
+
+            # finite differences for the fits whose derivatives blow up
+            # where the function doesn't (e.g. x**a at x=0)
+            bad = ~_n.isfinite(J).all(2).all(1)
+            if bad.any(): J[bad] = differences(p[bad], rows[bad], r[bad])
+            return J
+
+        # bad data sets don't get fit
+        failures = dict()
+        bad      = ~(_n.isfinite(Y).all(1) & _n.isfinite(EY).all(1) & (EY > 0).all(1))
+        for k in _n.flatnonzero(bad): failures[k] = "ValueError: The data has zeros, nan's or inf's in the error bars or nan's or inf's in the data."
+
+        active  = _n.flatnonzero(~bad)
+        damping = 1e-3*_n.ones(K)
+        moved   = _n.zeros(K, dtype=bool)
+        R       = _n.zeros((K, N))
+        R[active] = residuals(p[active], active)
+        chi2    = (R**2).sum(1)
+
+        # neither do the ones whose function blows up at the guess
+        blown = active[~_n.isfinite(chi2[active])]
+        for k in blown: failures[k] = "RuntimeError: The function gives nan's or inf's at the guess."
+        active = _n.setdiff1d(active, blown)
+
+        for i in range(iterations):
+            if not len(active): break
+            pa = p[active]
+            ra = R[active]
+
+            # damped normal equations for each fit: (A + damping*diag(A)) step = -J.r
+            J = jacobian(pa, active, ra)
+            A = _n.einsum('kpn,kqn->kpq', J, J)
+            g = _n.einsum('kpn,kn->kp',   J, ra)
+            M = A + damping[active][:,None,None]*A*_n.eye(P)
+            try:                        step = -_n.linalg.solve(M, g[:,:,None])[:,:,0]
+            except _n.linalg.LinAlgError: step = -_n.einsum('kpq,kq->kp', _n.linalg.pinv(M), g)
+
+            # try the steps, keeping the ones that help
+            trial    = pa + step
+            r_trial  = residuals(trial, active)
+            c_trial  = (r_trial**2).sum(1)
+            better   = _n.isfinite(c_trial) & (c_trial <= chi2[active])
+            ab       = active[better]
+
+            done = better & ((chi2[active]-c_trial <= ftol*chi2[active]) | (_n.absolute(step) <= xtol*(_n.absolute(pa)+xtol)).all(1))
+            p[ab]    = trial[better]
+            R[ab]    = r_trial[better]
+            chi2[ab] = c_trial[better]
+            moved[ab]                 = True
+            damping[ab]              *= 0.1
+            damping[active[~better]] *= 10.0
+
+            # damping this big means no step helps: we're at the minimum if
+            # we got anywhere, and stuck otherwise
+            stuck = damping[active] > 1e16
+            for k in active[stuck & ~moved[active]]:
+                failures[k] = "RuntimeError: No step improved the fit from the guess."
+            active = active[~(done | stuck)]
+
+        for k in active: failures[k] = "RuntimeError: Did not converge in "+str(iterations)+" iterations."
+
+        # errors from the covariance matrix (the same as leastsq's) at the result
+        ep   = _n.nan*_n.ones((K, P))
+        good = _n.array([k for k in range(K) if not k in failures], dtype=int)
+        if len(good):
+            J = jacobian(p[good], good, R[good])
+            A = _n.einsum('kpn,kqn->kpq', J, J)
+
+            # all at once, or one at a time if some are singular
+            try:    ep[good] = _n.sqrt(_n.diagonal(_n.linalg.inv(A), axis1=1, axis2=2))
+            except _n.linalg.LinAlgError:
+                for n in range(len(good)):
+                    try:    ep[good[n]] = _n.sqrt(_n.diag(_n.linalg.inv(A[n])))
+                    except _n.linalg.LinAlgError:
+                        failures[good[n]] = "RuntimeError: Singular covariance matrix (a parameter has no effect?)."
+
+        for k in failures: p[k] = _n.nan
+        rchi2 = chi2/(N-P)
+        rchi2[failures.keys()] = _n.nan
+        return p, ep, rchi2, failures
+
     def fix(self, *args, **kwargs):
         """
         Turns parameters to constants. As arguments, parameters must be strings.
@@ -1708,6 +3783,24 @@ class fitter():
         if p is None: p = self.results[0]
         return _n.concatenate(self.studentized_residuals(p))
 
+    def _studentized_residuals_jacobian(self, p):
+        """
+        Returns the derivatives of _studentized_residuals_concatenated(p)
+        with respect to each parameter (one row per parameter), from the
+        analytic derivatives of the functions. Used by leastsq() as Dfun.
+        """
+        N = sum([len(x) for x in self._xdata_massaged])
+        J = _n.empty((len(self._pnames), N))
+
+        for m in range(len(self._pnames)):
+            i = 0
+            for n in range(len(self.f)):
+                x = self._xdata_massaged[n]
+                J[m, i:i+len(x)] = -self._df[n][m](x, *p) / _n.absolute(self._eydata_massaged[n])
+                i += len(x)
+
+        return J
+
     def chi_squareds(self, p=None):
         """
         returns a list of chi squared for each data set. Also uses ydata_massaged.
@@ -2079,7 +4172,7 @@ class fitter():
 # Dialogs for loading data
 ############################
 
-def load(path="ask", first_data_line="auto", filters="*.*", text="Select a file, FACEHEAD.", default_directory="default_directory", quiet=False, header_only=False, **kwargs):
+def load(path="ask", first_data_line="auto", filters="*.*", text="Select a file, FACEHEAD.", default_directory="default_directory", quiet=False, header_only=False, parser="fast", lazy=False, cache=None, **kwargs):
     """
     Loads a data file into the databox data class. Returns the data object.
 
@@ -2094,17 +4187,49 @@ def load(path="ask", first_data_line="auto", filters="*.*", text="Select a file,
     d = databox(**kwargs)
     d.load_file(path=path, first_data_line=first_data_line,
                 filters=filters, text=text, default_directory=default_directory,
-                header_only=header_only)
+                header_only=header_only, parser=parser, lazy=lazy, cache=cache)
+
+    if not quiet: print "\nloaded", d.path, "\n"
+
+    return d
+
+def load_h5(path="ask", group=None, filters="*.h5", text="Select a file, FACEHEAD.", quiet=False, header_only=False, rows=None, lazy=False, **kwargs):
+    """
+    Loads a databox saved with databox.save_h5() from the specified group of
+    an HDF5 file. Returns the databox.
+
+    **kwargs are sent to databox(). See databox.load_h5() for the rest.
+    """
+    d = databox(**kwargs)
+    d.load_h5(path=path, group=group, filters=filters, text=text, header_only=header_only,
+              quiet=quiet, rows=rows, lazy=lazy)
 
     if not quiet: print "\nloaded", d.path, "\n"
 
     return d
 
-def load_multiple(paths="ask", first_data_line="auto", filters="*.*", text="Select some files, FACEHEAD.", default_directory="default_directory", **kwargs):
+def iter_chunks(path="ask", rows=10000, first_data_line="auto", filters="*.*", text="Select a file, FACEHEAD.", quiet=False, parser="fast", **kwargs):
+    """
+    Generator yielding databoxes holding successive chunks of (at most) the
+    specified number of rows from one (possibly huge) data file. The header
+    is only parsed once, and only one chunk is in memory at a time.
+
+    **kwargs are sent to databox(), so check there for more information (i.e.
+    about delimiters)
+
+    See databox.iter_chunks() for more information.
+    """
+    return databox(**kwargs).iter_chunks(path=path, rows=rows, first_data_line=first_data_line,
+                                         filters=filters, text=text, quiet=quiet, parser=parser)
+
+def load_multiple(paths="ask", first_data_line="auto", filters="*.*", text="Select some files, FACEHEAD.", default_directory="default_directory", workers=1, **kwargs):
     """
     Loads a list of data files into a list of databox data objects.
     Returns said list.
 
+    workers=1   Number of processes parsing the files at the same time.
+                None means one per cpu. See iter_multiple().
+
     **kwargs are sent to databox()
 
     The most common modification to the default behavior is to change the
@@ -2115,8 +4240,184 @@ def load_multiple(paths="ask", first_data_line="auto", filters="*.*", text="Sele
     if paths == "ask": paths = _dialogs.open_multiple(filters, text, default_directory)
     if paths is None : return
 
-    datas = []
-    for path in paths:
-        if _os.path.isfile(path): datas.append(load(path, first_data_line, **kwargs))
+    return list(iter_multiple(paths, first_data_line, workers, **kwargs))
+
+def iter_multiple(paths, first_data_line="auto", workers=1, **kwargs):
+    """
+    Generator loading the list of data files, yielding the databoxes in the
+    same order as the paths (skipping those that aren't files) as soon as
+    each one is ready. This way you can start plotting / analyzing the first
+    files while the rest are still being parsed.
+
+    workers=1   Number of processes parsing the files at the same time.
+                None means one per cpu. With more than one worker the files
+                are parsed in a multiprocessing pool, so on Windows your script
+                needs the usual "if __name__ == '__main__':" guard.
+
+    **kwargs are sent to load()
+    """
+    paths = [p for p in paths if _os.path.isfile(p)]
+
+    # one at a time
+    if workers == 1 or len(paths) < 2:
+        for path in paths: yield load(path, first_data_line, **kwargs)
+        return
+
+    # the workers keep quiet; we print as the results come in
+    quiet = kwargs.pop('quiet', False)
+    kwargs['quiet'] = True
+
+    pool = _multiprocessing.Pool(workers)
+    try:
+        for d in pool.imap(_load_worker, [(p, first_data_line, kwargs) for p in paths]):
+            if not quiet: print "\nloaded", d.path, "\n"
+            yield d
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _load_worker(args):
+    """
+    Loads one file for iter_multiple() in a worker process.
+    args = (path, first_data_line, kwargs for load()).
+    """
+    return load(args[0], args[1], **args[2])
+
+def concatenate(databoxes, axis='rows', source_column=None, **kwargs):
+    """
+    Combines a list of databoxes into a single new databox, copying each
+    column's data only once (into a preallocated array). Returns the new
+    databox, or None if the databoxes don't fit together.
+
+    axis='rows'         Stacks the data points. All the databoxes must have
+                        the same ckeys (in any order; the first databox's
+                        order is used), and each column gets the most general
+                        dtype of its pieces.
+    axis='columns'      Puts all the columns side by side. No two databoxes
+                        can share a ckey.
+    source_column=None  For axis='rows', the name of an extra column holding
+                        the index (in databoxes) of the databox each row came
+                        from.
+
+    With axis='rows', each databox's rows are set by its longest column, and
+    shorter columns are padded with nan's (as if saved and loaded) so the
+    rows stay lined up.
+
+    Headers with the same value in every databox are kept as is. Those that
+    differ (or are missing from some of the databoxes) are stored as a list
+    with one value per databox (None where it was missing).
+
+    **kwargs are sent to databox()
+    """
+    databoxes = list(databoxes)
+    d         = databox(**kwargs)
+    if not len(databoxes): return d
+
+    # make sure the ckeys fit together
+    ckeys = list(databoxes[0].ckeys)
+    if axis == 'rows':
+        for n in range(len(databoxes)):
+            if not set(databoxes[n].ckeys) == set(ckeys):
+                print "ERROR: databoxes[0] and databoxes["+str(n)+"] have different ckeys, so their rows can't be concatenated."
+                return None
+        if source_column in ckeys:
+            print "ERROR: source_column "+repr(source_column)+" is already a ckey."
+            return None
+
+    elif axis == 'columns':
+        ckeys = []
+        for x in databoxes: ckeys = ckeys + list(x.ckeys)
+        if not len(set(ckeys)) == len(ckeys):
+            print "ERROR: Some databoxes share ckeys, so their columns can't be concatenated."
+            return None
+
+    else:
+        print "ERROR: axis must be 'rows' or 'columns'."
+        return None
+
+    # headers, in order of appearance
+    hkeys = []
+    for x in databoxes:
+        for k in x.hkeys:
+            if not k in hkeys: hkeys.append(k)
+
+    for k in hkeys:
+        values = [x.headers[k] if k in x.headers else None for x in databoxes]
+        if all([k in x.headers and repr(x.headers[k]) == repr(values[0]) for x in databoxes]): d.insert_header(k, values[0])
+        else:                                                                                  d.insert_header(k, values)
+
+    # columns side by side don't need any new arrays
+    if axis == 'columns':
+        for x in databoxes:
+            for k in x.ckeys: d[k] = x[k]
+        return d
+
+    # rows: each databox's longest column sets its number of rows
+    rows = [max([0]+[len(_n.atleast_1d(x[k])) for k in ckeys]) for x in databoxes]
+
+    # one output array per column, filled in a single pass
+    for k in ckeys:
+        pieces = [_n.atleast_1d(_n.asarray(x[k])) for x in databoxes]
+
+        # short pieces get padded with nan's, so the column has to hold them
+        dtype = _n.result_type(*pieces)
+        if any([len(pieces[n]) < rows[n] for n in range(len(pieces))]): dtype = _n.result_type(dtype, float)
+
+        a = _n.empty(sum(rows), dtype)
+        i = 0
+        for n in range(len(pieces)):
+            a[i:i+len(pieces[n])] = pieces[n]
+            if len(pieces[n]) < rows[n]: a[i+len(pieces[n]):i+rows[n]] = _n.nan
+            i += rows[n]
+
+        # insert_column() would copy it again
+        if d.storage == 'dict':
+            d.ckeys.append(k)
+            d.columns[k] = a
+        else: d[k] = a
+
+    # index of the databox each row came from
+    if source_column is not None: d[source_column] = _n.repeat(_n.arange(len(databoxes)), rows)
+
+    return d
+
+# fitters rebuilt by _fit_many_worker(), so each process only compiles a model once
+_fit_many_fitters = dict()
+
+def _fit_many_worker(args):
+    """
+    Does one chunk of fitter.fit_many() in a worker process.
+    args = (model spec, method, indices, xdatas, ydatas, eydatas, pguesses),
+    where the spec ends with the pickled globals (or None).
+    """
+    spec = args[0]
+
+    # get a fitter for this model
+    if not spec in _fit_many_fitters:
+        if len(_fit_many_fitters) > 10: _fit_many_fitters.clear()
+        f, p, c, evaluator, jacobian, gs = spec
+        if gs is None: g = None
+        else:          g = _pickle.loads(gs)
+        _fit_many_fitters[spec] = fitter(f, p, c, g=g, autoplot=False, silent=True, evaluator=evaluator, jacobian=jacobian)
+
+    return _fit_many_chunk(_fit_many_fitters[spec], *args[1:])
 
-    return datas
+def _fit_many_chunk(fitter_, method, ks, xs, ys, eys, pguesses):
+    """
+    Fits one chunk of fitter.fit_many()'s data sets with fitter_.
+    Returns a list of (index, p, ep, reduced chi squared, error message).
+    """
+    # all at once
+    if method == 'lm':
+        try: p, ep, rchi2, failures = fitter_._fit_chunk_lm(xs, ys, eys, pguesses)
+        except Exception as e:
+            return [(k, None, None, None, type(e).__name__+': '+str(e)) for k in ks]
+        return [(ks[n], p[n], ep[n], rchi2[n], failures.get(n)) for n in range(len(ks))]
+
+    # one at a time
+    results = []
+    for n in range(len(ks)):
+        try:    results.append((ks[n],) + tuple(fitter_._fit_one(xs[n], ys[n], eys[n], pguesses[n])) + (None,))
+        except Exception as e: results.append((ks[n], None, None, None, type(e).__name__+': '+str(e)))
+    return results
@@ -0,0 +1,152 @@
+import ast   as _ast
+import numpy as _n
+
+# derivatives of the one-argument numpy functions, in terms of their
+# argument {0} (the chain rule takes care of the rest)
+functions = dict(sin     = 'cos({0})',
+                 cos     = '-sin({0})',
+                 tan     = '1/cos({0})**2',
+                 arcsin  = '1/sqrt(1-{0}**2)',
+                 arccos  = '-1/sqrt(1-{0}**2)',
+                 arctan  = '1/(1+{0}**2)',
+                 sinh    = 'cosh({0})',
+                 cosh    = 'sinh({0})',
+                 tanh    = '1/cosh({0})**2',
+                 arcsinh = '1/sqrt({0}**2+1)',
+                 arccosh = '1/sqrt({0}**2-1)',
+                 arctanh = '1/(1-{0}**2)',
+                 exp     = 'exp({0})',
+                 expm1   = 'exp({0})',
+                 log     = '1/{0}',
+                 log10   = '1/({0}*log(10))',
+                 log1p   = '1/(1+{0})',
+                 sqrt    = '0.5/sqrt({0})',
+                 abs     = 'sign({0})',
+                 absolute= 'sign({0})')
+
+
+class NotDifferentiable(Exception):
+    """
+    Raised when we don't know how to differentiate an expression, meaning
+    the caller should use finite differences.
+    """
+    pass
+
+
+def derivative(source, name, g=None):
+    """
+    Returns the source of the partial derivative of the python expression
+    source (e.g. 'a*x*cos(b*x)+c') with respect to the variable name.
+
+    Only arithmetic and the numpy functions above can depend on name. If g
+    (the globals the expression will be evaluated with) is supplied, the
+    function names must really refer to numpy's functions there.
+
+    Raises NotDifferentiable if it can't be done.
+    """
+    try:    tree = _ast.parse(source.strip(), mode='eval')
+    except: raise NotDifferentiable(source)
+    return _derivative(tree.body, name, g)
+
+def _source(node):
+    """
+    Returns the (fully bracketed) source for node.
+    """
+    if isinstance(node, _ast.Num):  return '('+repr(node.n)+')'
+    if isinstance(node, _ast.Name): return node.id
+
+    if isinstance(node, _ast.BinOp):
+        return '('+_source(node.left)+_operators[type(node.op)]+_source(node.right)+')'
+
+    if isinstance(node, _ast.UnaryOp) and type(node.op) in _operators:
+        return '('+_operators[type(node.op)]+_source(node.operand)+')'
+
+    if isinstance(node, _ast.Call) and not node.keywords and node.starargs is None and node.kwargs is None:
+        return _source(node.func)+'('+', '.join([_source(a) for a in node.args])+')'
+
+    if isinstance(node, _ast.Attribute): return _source(node.value)+'.'+node.attr
+
+    if isinstance(node, _ast.Subscript) and isinstance(node.slice, _ast.Index):
+        return _source(node.value)+'['+_source(node.slice.value)+']'
+
+    raise NotDifferentiable(_ast.dump(node))
+
+_operators = {_ast.Add:'+', _ast.Sub:'-', _ast.Mult:'*', _ast.Div:'/', _ast.Pow:'**',
+              _ast.USub:'-', _ast.UAdd:'+'}
+
+def _depends_on(node, name):
+    """
+    Returns True if the variable name appears anywhere in node.
+    """
+    for n in _ast.walk(node):
+        if isinstance(n, _ast.Name) and n.id == name: return True
+    return False
+
+# the derivative strings are simplified as they're built, so the zeros and
+# ones don't cost anything when they're evaluated
+def _add(a, b):
+    if a == '0': return b
+    if b == '0': return a
+    return '('+a+'+'+b+')'
+
+def _sub(a, b):
+    if b == '0': return a
+    if a == '0': return '(-'+b+')'
+    return '('+a+'-'+b+')'
+
+def _mul(a, b):
+    if a == '0' or b == '0': return '0'
+    if a == '1': return b
+    if b == '1': return a
+    return '('+a+'*'+b+')'
+
+def _div(a, b):
+    if a == '0': return '0'
+    if b == '1': return a
+    if a == '1': a = '1.0' # python 2 integer division
+    return '('+a+'/'+b+')'
+
+def _derivative(node, name, g):
+    """
+    Returns the source of d(node)/d(name).
+    """
+    if not _depends_on(node, name): return '0'
+    if isinstance(node, _ast.Name): return '1'
+
+    if isinstance(node, _ast.UnaryOp):
+        if isinstance(node.op, _ast.UAdd): return _derivative(node.operand, name, g)
+        if isinstance(node.op, _ast.USub): return _sub('0', _derivative(node.operand, name, g))
+
+    if isinstance(node, _ast.BinOp):
+        u,  v  = _source(node.left), _source(node.right)
+        du, dv = _derivative(node.left, name, g), _derivative(node.right, name, g)
+
+        if isinstance(node.op, _ast.Add):  return _add(du, dv)
+        if isinstance(node.op, _ast.Sub):  return _sub(du, dv)
+        if isinstance(node.op, _ast.Mult): return _add(_mul(du, v), _mul(u, dv))
+        if isinstance(node.op, _ast.Div):  return _sub(_div(du, v), _div(_mul(u, dv), '('+v+'**2)'))
+
+        if isinstance(node.op, _ast.Pow):
+            # constant exponent: n*u**(n-1)*du
+            if dv == '0': return _mul(_mul(v, '('+u+'**('+v+'-1))'), du)
+
+            # otherwise u**v * (dv*log(u) + v*du/u)
+            return _mul('('+u+'**'+v+')', _add(_mul(dv, 'log('+u+')'), _div(_mul(v, du), u)))
+
+    if isinstance(node, _ast.Call) and isinstance(node.func, _ast.Name) \
+    and not node.keywords and node.starargs is None and node.kwargs is None:
+        f = node.func.id
+
+        # the function has to really be numpy's
+        if g is not None and not g.get(f) is getattr(_n, f, None): raise NotDifferentiable(f)
+
+        if f in functions and len(node.args) == 1:
+            u = _source(node.args[0])
+            return _mul('('+functions[f].format(u)+')', _derivative(node.args[0], name, g))
+
+        if f == 'arctan2' and len(node.args) == 2:
+            y,  x  = _source(node.args[0]), _source(node.args[1])
+            dy, dx = _derivative(node.args[0], name, g), _derivative(node.args[1], name, g)
+            return _div(_sub(_mul(x, dy), _mul(y, dx)), '('+x+'**2+'+y+'**2)')
+
+    raise NotDifferentiable(_ast.dump(node))
@@ -0,0 +1,200 @@
+import ast                as _ast
+import multiprocessing    as _multiprocessing
+import numpy              as _n
+
+from multiprocessing.pool import ThreadPool as _ThreadPool
+
+# numexpr is optional; without it we evaluate in cache-sized blocks with numpy
+try:    import numexpr as _numexpr
+except: _numexpr = None
+
+
+# number of data points per block when evaluating with numpy
+block_size = 2**14
+
+# arrays shorter than this aren't worth fusing (plain eval() is faster)
+minimum_size = 2*block_size
+
+# number of threads to use (numexpr manages its own)
+try:    threads = _multiprocessing.cpu_count()
+except: threads = 1
+
+# element-wise numpy functions we know how to fuse, and their numexpr names
+functions = dict(sin='sin', cos='cos', tan='tan', arcsin='arcsin', arccos='arccos',
+                 arctan='arctan', arctan2='arctan2', sinh='sinh', cosh='cosh',
+                 tanh='tanh', arcsinh='arcsinh', arccosh='arccosh', arctanh='arctanh',
+                 exp='exp', expm1='expm1', log='log', log10='log10', log1p='log1p',
+                 sqrt='sqrt', abs='abs', absolute='abs')
+
+_operators = {_ast.Add:'+', _ast.Sub:'-', _ast.Mult:'*', _ast.Div:'/', _ast.Pow:'**',
+              _ast.Mod:'%', _ast.FloorDiv:'//', _ast.USub:'-', _ast.UAdd:'+'}
+
+_pool = None
+
+
+class Unfusable(Exception):
+    """
+    Raised when an expression (or the values it gets) can't be fused, meaning
+    the caller should just use eval().
+    """
+    pass
+
+
+class expression:
+
+    def __init__(self, source):
+        """
+        Compiles the arithmetic in the python expression source (e.g.
+        "a*x**2 + b*sin(c('y'))") into a single fused evaluation over the
+        data, so no full-size temporary arrays are created.
+
+        Anything that isn't arithmetic or one of the functions above (names,
+        column lookups like c('y') or d[0], other calls, etc) becomes a "leaf"
+        that is evaluated normally once, and must give either a scalar or a
+        1-D numeric array, with all arrays having the same length.
+
+        Raises Unfusable if there's no arithmetic to fuse.
+        """
+        self.source = source
+
+        try:    tree = _ast.parse(source.strip(), mode='eval')
+        except: raise Unfusable(source)
+
+        # leaf codes, the functions used, and whether numexpr can do it
+        self.leaves    = []
+        self.functions = []
+        self.numexpr   = True
+
+        # the expression rewritten in terms of _leaf0, _leaf1, ...
+        if not self._is_arithmetic(tree.body): raise Unfusable(source)
+        self.text = self._rewrite(tree.body)
+        self.code = compile(self.text, '<fused>', 'eval')
+
+    def _is_arithmetic(self, node):
+        """
+        Returns True if node is an operator or fusable function call.
+        """
+        if isinstance(node, (_ast.BinOp, _ast.UnaryOp)):
+            return type(node.op) in _operators
+        if isinstance(node, _ast.Call):
+            return isinstance(node.func, _ast.Name) and node.func.id in functions \
+               and not node.keywords and node.starargs is None and node.kwargs is None
+        return False
+
+    def _rewrite(self, node):
+        """
+        Returns the source for node, with all the leaves replaced by names.
+        """
+        if isinstance(node, _ast.Num): return '('+repr(node.n)+')'
+
+        if not self._is_arithmetic(node):
+            name = '_leaf'+str(len(self.leaves))
+            self.leaves.append(compile(_ast.Expression(node), '<leaf>', 'eval'))
+            return name
+
+        if isinstance(node, _ast.BinOp):
+            if isinstance(node.op, _ast.FloorDiv): self.numexpr = False
+            return '('+self._rewrite(node.left)+_operators[type(node.op)]+self._rewrite(node.right)+')'
+
+        if isinstance(node, _ast.UnaryOp):
+            return '('+_operators[type(node.op)]+self._rewrite(node.operand)+')'
+
+        # function call
+        self.functions.append(node.func.id)
+        return node.func.id+'('+', '.join([self._rewrite(a) for a in node.args])+')'
+
+    def __call__(self, g, v=None):
+        """
+        Evaluates the expression using globals g and locals v (like eval()).
+        Raises Unfusable if the values can't be fused.
+        """
+
+        # the functions must really be numpy's (not something the user defined)
+        for name in self.functions:
+            if v is not None and name in v:                      raise Unfusable(name)
+            if not g.get(name) is getattr(_n, name, None):       raise Unfusable(name)
+
+        # evaluate the leaves, making sure they're scalars or matching arrays
+        leaves = dict()
+        N      = None
+        kinds  = ''
+        for n in range(len(self.leaves)):
+            x = eval(self.leaves[n], g, v)
+
+            if isinstance(x, _n.ndarray):
+                if not x.ndim == 1 or not x.dtype.kind in 'biufc': raise Unfusable(self.source)
+                if N is None: N = len(x)
+                elif not N == len(x):                               raise Unfusable(self.source)
+                kinds = kinds + x.dtype.kind
+
+            elif not isinstance(x, (int, long, float, complex, _n.number)):
+                raise Unfusable(self.source)
+
+            leaves['_leaf'+str(n)] = x
+
+        # only worth it for big arrays
+        if N is None or N < minimum_size: raise Unfusable(self.source)
+
+        # numexpr (floats only, so the integer and complex rules match numpy's)
+        if _numexpr is not None and self.numexpr and kinds.strip('f') == '':
+            return _numexpr.evaluate(self._numexpr_text(), local_dict=leaves, global_dict={})
+
+        return self._evaluate_blocks(leaves, N)
+
+    def _numexpr_text(self):
+        """
+        Returns self.text with the numpy function names swapped for numexpr's.
+        """
+        text = self.text
+        for name in set(self.functions):
+            text = text.replace(name+'(', functions[name]+'(')
+        return text
+
+    def _evaluate_blocks(self, leaves, N):
+        """
+        Evaluates self.code a block at a time, so the temporaries stay small.
+        """
+        g = dict(__builtins__={})
+        for name in self.functions: g[name] = getattr(_n, name)
+
+        def block(i):
+            v = dict()
+            for k in leaves:
+                if isinstance(leaves[k], _n.ndarray): v[k] = leaves[k][i:i+block_size]
+                else:                                 v[k] = leaves[k]
+            return eval(self.code, g, v)
+
+        # the first block tells us the type of the output
+        first = block(0)
+        if not isinstance(first, _n.ndarray) or not first.shape == (min(block_size, N),):
+            raise Unfusable(self.source)
+
+        output = _n.empty(N, first.dtype)
+        output[0:len(first)] = first
+
+        def fill(i): output[i:i+block_size] = block(i)
+
+        # numpy releases the GIL, so threads help when there are enough cores
+        starts = range(block_size, N, block_size)
+        if threads > 1 and len(starts) > 1: _get_pool().map(fill, starts)
+        else:
+            for i in starts: fill(i)
+
+        return output
+
+
+def _get_pool():
+    """
+    Returns the shared thread pool, starting it if necessary.
+    """
+    global _pool
+    if _pool is None: _pool = _ThreadPool(threads)
+    return _pool
+
+
+def compile_expression(source):
+    """
+    Returns a fused expression for source, or None if it can't be fused.
+    """
+    try:    return expression(source)
+    except: return None
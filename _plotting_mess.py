@@ -688,6 +688,7 @@ def files(xscript=0, yscript=1, eyscript=None, exscript=None, plotter=xy_databox
     xscript, yscript, eyscript, exscript    scripts to generate x, y, and errors
 
     optional: filters="*.*" to set the file filters for the dialog.
+              workers=1 to parse the files in parallel (see data.load_multiple).
 
     **kwargs are sent to plotter()
     """
@@ -697,7 +698,10 @@ def files(xscript=0, yscript=1, eyscript=None, exscript=None, plotter=xy_databox
     if kwargs.has_key('filters'): filters = kwargs.pop('filters')
     else:                         filters = '*.*'
 
-    ds = _data.load_multiple(paths=paths, delimiter=delimiter, filters=filters)
+    if kwargs.has_key('workers'): workers = kwargs.pop('workers')
+    else:                         workers = 1
+
+    ds = _data.load_multiple(paths=paths, delimiter=delimiter, filters=filters, workers=workers)
     if ds is None or len(ds) == 0: return
 
     # generate a default title (the directory)
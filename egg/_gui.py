@@ -1989,11 +1989,13 @@ class DataboxPlot(_d.databox, GridLayout):
         """
         self.load_file()
 
-    def save_file(self, path="ask", force_overwrite=False, just_settings=False):
+    def save_file(self, path="ask", force_overwrite=False, just_settings=False, append=False, fsync=False):
         """
         Saves the data in the databox to a file.
 
         just_settings=True means only save the configuration of the controls
+        append, fsync   sent to databox.save_file(); append=True only writes
+                        the rows added since the last append=True save.
         """
 
         # if it's just the settings file, make a new databox
@@ -2006,7 +2008,7 @@ class DataboxPlot(_d.databox, GridLayout):
         for x in self._autosettings_controls: self._store_gui_setting(d, x)
 
         # save the file
-        _d.databox.save_file(d, path, self._file_type, force_overwrite)
+        _d.databox.save_file(d, path, self._file_type, force_overwrite, append=append, fsync=fsync)
 
     def load_file(self, path="ask", just_settings=False):
         """
@@ -2167,18 +2169,25 @@ class DataboxPlot(_d.databox, GridLayout):
 
         return self
 
-    def autosave(self):
+    def autosave(self, append=False, fsync=False):
         """
         Autosaves the currently stored data, but only if autosave is checked!
+
+        append=True is for experiments that add data points as they go: only
+        the new rows are written onto the end of the current file, and the
+        file number is not incremented. Call autosave() without append to
+        write the whole file one last time and move on to the next number.
+        fsync=True also forces the rows onto the disk after each write.
         """
         # make sure we're suppoed to
         if self.button_autosave.is_checked():
 
             # save the file
-            self.save_file(_os.path.join(self._autosave_directory, "%04d " % (self.number_file.get_value()) + self._label_path.get_text()))
+            self.save_file(_os.path.join(self._autosave_directory, "%04d " % (self.number_file.get_value()) + self._label_path.get_text()),
+                           append=append, fsync=fsync)
 
             # increment the counter
-            self.number_file.increment()
+            if not append: self.number_file.increment()
 
     def autozoom(self, n=None):
         """
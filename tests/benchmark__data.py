@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Rough benchmarks for _data.py. These are not unit tests; run this file
+directly to print the timings:
+
+    python benchmark__data.py
+"""
+import os
+import time
+import numpy as _n
+import spinmob as sm
+_dt = sm._data
+
+fixtures_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'data_types')
+
+
+def rate(f, duration=1.0):
+    """
+    Calls f() repeatedly for about duration seconds and returns the number
+    of calls per second.
+    """
+    n  = 0
+    t0 = time.time()
+    while time.time()-t0 < duration:
+        f()
+        n += 1
+    return n/(time.time()-t0)
+
+def benchmark_load_file_parsers():
+    """
+    Loads per second of the fixtures with the fast and complex parsers.
+    """
+    print "\nload_file() loads per second"
+    for filename in sorted(os.listdir(fixtures_path)):
+        if not filename.endswith('.dat'): continue
+
+        path = os.path.join(fixtures_path, filename)
+        if filename.startswith('CSV'): d = _dt.databox(delimiter=', ')
+        else:                          d = _dt.databox()
+
+        fast = rate(lambda: d.load_file(path, parser='fast',    quiet=True))
+        slow = rate(lambda: d.load_file(path, parser='complex', quiet=True))
+        print "  {:24s} fast {:8.0f}   complex {:8.0f}   ({:.1f}x)".format(filename, fast, slow, fast/slow)
+
+def benchmark_append_data_point(n=100000):
+    """
+    Time to append n data points one at a time, printed for each block of
+    n/10 appends so you can see that the cost per append stays flat.
+    """
+    print "\nappend_data_point() microseconds per append, "+str(n)+" appends"
+    for storage in ['dict', 'block']:
+        d = _dt.databox(storage=storage)
+        d['x'] = []; d['y'] = []; d['z'] = []
+
+        times = []
+        for m in range(10):
+            t0 = time.time()
+            for i in xrange(n/10): d.append_data_point([i, 1.0, 2.0])
+            times.append(1e6*(time.time()-t0)/(n/10))
+        print "  {:6s} ".format(storage) + " ".join(["{:5.1f}".format(t) for t in times])
+
+def benchmark_fused_scripts(N=10**7):
+    """
+    Time to run an arithmetic script on N-point columns with eval() and
+    with the fused evaluator.
+    """
+    print "\nexecute_script() seconds on "+str(N)+" points"
+    d = _dt.databox()
+    d['x'] = _n.random.rand(N)
+    d['y'] = _n.random.rand(N)
+    d.h(gain=2.0)
+    script = "a*c('x')**2 + b*sin(c('y')) - x/(1+x) where a=h('gain'); b=3; x=c(0)"
+
+    for evaluator in ['eval', 'fused']:
+        d.evaluator = evaluator
+        t0 = time.time()
+        d.execute_script(script)
+        print "  {:6s} {:.3f}".format(evaluator, time.time()-t0)
+
+def benchmark_concatenate(boxes=300, rows=1000):
+    """
+    Time to stitch many sweep databoxes into one with concatenate() and with
+    the usual loops.
+    """
+    print "\nconcatenate() seconds for "+str(boxes)+" databoxes of "+str(rows)+" rows"
+    sweeps = []
+    for n in range(boxes):
+        d = _dt.databox()
+        d.h(sweep=n)
+        d['x'] = _n.arange(rows)*1.0
+        d['y'] = _n.random.rand(rows)
+        d['z'] = _n.random.rand(rows)
+        sweeps.append(d)
+
+    t0 = time.time()
+    _dt.concatenate(sweeps, source_column='sweep')
+    print "  concatenate()       {:.3f}".format(time.time()-t0)
+
+    t0 = time.time()
+    c = _dt.databox()
+    for k in sweeps[0].ckeys: c[k] = []
+    for d in sweeps:
+        for k in d.ckeys: c[k] = _n.concatenate([c[k], d[k]])
+    print "  insert_column loop  {:.3f}".format(time.time()-t0)
+
+    t0 = time.time()
+    c = _dt.databox()
+    for k in sweeps[0].ckeys: c[k] = []
+    for d in sweeps:
+        for i in xrange(len(d[0])): c.append_data_point(d.get_data_point(i))
+    print "  append_data_point   {:.3f}".format(time.time()-t0)
+
+def benchmark_fit_jacobian(N=100000):
+    """
+    Function evaluations and time for a 10-parameter fit with finite
+    differences and with the analytic jacobian.
+    """
+    print "\nfitter.fit() on "+str(N)+" points, 10 parameters"
+    f = ' + '.join(['a'+str(n)+'*exp(-(x-b'+str(n)+')**2)' for n in range(5)])
+    p = ', '.join(['a'+str(n)+'=1.2, b'+str(n)+'='+str(2*n+0.2) for n in range(5)])
+
+    x = _n.linspace(-2, 10, N)
+    y = sum([(n+1)*_n.exp(-(x-2*n)**2) for n in range(5)]) + _n.random.normal(0, 0.1, N)
+
+    for jacobian in ['numerical', 'analytic']:
+        fitter = _dt.fitter(f, p, autoplot=False, silent=True, jacobian=jacobian)
+        fitter.set_data(x, y, 0.1)
+        t0 = time.time()
+        fitter.fit()
+        info = fitter.results[2]
+        print "  {:10s} {:.3f} s  {:4d} evaluations of f  {:4d} jacobians".format(jacobian, time.time()-t0, info['nfev'], info.get('njev', 0))
+
+def benchmark_fit_many(K=10000, N=300):
+    """
+    Time to fit a Lorentzian to K traces of N points with a loop over
+    fitter.fit(), with fit_many() and with fit_many(method='lm'). The slow
+    ones are timed on a subset and scaled up.
+    """
+    print "\nseconds to fit "+str(K)+" traces of "+str(N)+" points"
+    x  = _n.linspace(-5, 5, N)
+    ys = [1.0/(1+(x-x0)**2/0.25) + _n.random.normal(0, 0.02, N) for x0 in _n.random.uniform(-0.3, 0.3, K)]
+    f  = 'A/(1+(x-x0)**2/w**2)+c'
+    p  = 'A=1, x0=0, w=0.4, c=0'
+
+    n  = min(K, 200)
+    t0 = time.time()
+    for y in ys[0:n]:
+        fitter = _dt.fitter(f, p, autoplot=False, silent=True)
+        fitter.set_data(x, y, 0.02)
+        fitter.fit()
+    loop = (time.time()-t0)*K/n
+    print "  fit() loop          {:.2f} (estimated)".format(loop)
+
+    fitter = _dt.fitter(f, p, autoplot=False, silent=True)
+    n  = min(K, 1000)
+    t0 = time.time()
+    fitter.fit_many(x, ys[0:n], 0.02)
+    print "  fit_many()          {:.2f} (estimated)".format((time.time()-t0)*K/n)
+
+    t0 = time.time()
+    fitter.fit_many(x, ys, 0.02, method='lm')
+    lm = time.time()-t0
+    print "  fit_many('lm')      {:.2f}   ({:.0f}x the loop)".format(lm, loop/lm)
+
+def benchmark_fitter_constants(n=10000):
+    """
+    Time per update when sweeping a fitter constant n times.
+    """
+    print "\nfitter constant updates, microseconds per update"
+    fitter = _dt.fitter('a*x*cos(b*x)+c*x**2+d', 'a, b, d', 'c=1.0', autoplot=False, silent=True)
+    t0 = time.time()
+    for i in xrange(n): fitter['c'] = 1.0+i
+    print "  {:.1f}".format(1e6*(time.time()-t0)/n)
+
+
+if __name__ == "__main__":
+    benchmark_load_file_parsers()
+    benchmark_append_data_point()
+    benchmark_fused_scripts()
+    benchmark_concatenate()
+    benchmark_fit_jacobian()
+    benchmark_fit_many()
+    benchmark_fitter_constants()
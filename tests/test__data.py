@@ -119,6 +119,40 @@ class Test_databox(_ut.TestCase):
         exp = [993.9, 713.0, 70.4, -14.7, -51.6]
         self.assertListEqual(val, exp)
 
+    def test_execute_script_fused(self):
+        """
+        The fused evaluator should agree with eval(), and fall back to it.
+        """
+        d = _dt.databox()
+        d['x'] = _n.linspace(0, 1, 3*_dt._fused.minimum_size)
+        d['y'] = _n.linspace(1, 2, 3*_dt._fused.minimum_size)
+        scripts = ["2*c('x')**2 + b*sin(y) where b=3; y=c(1)", 'x+1 where x=d[0]', 'len(d[0])']
+
+        expected = [d.execute_script(s) for s in scripts]
+        d.evaluator = 'fused'
+        for n in range(len(scripts)):
+            self.assertTrue(_n.allclose(d.execute_script(scripts[n]), expected[n]))
+
+        self.assertListEqual(_dt._compile_script(scripts[0])[3].functions, ['sin'])
+        self.assertIsNone(_dt._compile_script(scripts[2])[3])
+
+    def test_execute_script_cached(self):
+        """
+        Repeated scripts should reuse the compiled code and globals, but still
+        see changes to extra_globals.
+        """
+        self.databox.load_file(path=self.data_path)
+        script = 'k*x where x=c(0)'
+        self.databox.insert_global(2.0, 'k')
+        self.assertEqual(self.databox.execute_script(script)[0], 170.0)
+        self.assertIs(_dt._compile_script(script), _dt._compile_script(script))
+        self.assertIs(self.databox._globals(), self.databox._globals())
+
+        self.databox.insert_global(3.0, 'k')
+        self.assertEqual(self.databox.execute_script(script)[0], 255.0)
+        self.assertEqual(self.databox.execute_script('sum(x*i for i in [1,2]) where x=c(0)')[0], 255.0)
+        self.databox.extra_globals.pop('k')
+
     def test___len__(self):
         self.databox.load_file(path=self.data_path)
         val = self.databox.__len__()
@@ -195,6 +229,36 @@ class Test_databox(_ut.TestCase):
         exp = 'value1'
         self.assertEqual(val, exp)
 
+    def test_h_FragmentOrder(self):
+        """
+        The first key containing the fragment should win, after any changes.
+        """
+        d = _dt.databox()
+        for k in ['sweep/x/gain', 'sweep/y/gain', 'xy']: d.insert_header(k, k)
+        self.assertEqual(d.h('gain'), 'sweep/x/gain')
+        self.assertEqual(d.h('y'), 'sweep/y/gain')
+
+        d.insert_header('gain/top', 'top', 0)
+        d.pop_header('sweep/y/gain')
+        self.assertEqual(d.h('gain'), 'top')
+        self.assertEqual(d.h('y'), 'xy')
+        self.assertFalse('sweep/y/gain' in d.hkeys)
+
+    def test_decode_header_value(self):
+        """
+        Header literals should decode without eval(), which is opt-in.
+        """
+        d = _dt.databox()
+        self.assertEqual(d._decode_header_value("[1, 'a', (2+3j), None]"), [1, 'a', 2+3j, None])
+        a = d._decode_header_value("array([1, 2], dtype=int32)")
+        self.assertEqual(a.dtype, _n.int32)
+        self.assertListEqual(a.tolist(), [1, 2])
+        self.assertTrue(_n.isnan(d._decode_header_value("nan")))
+
+        self.assertEqual(d._decode_header_value("sqrt(4)"), "sqrt(4)")
+        d.eval_headers = True
+        self.assertEqual(d._decode_header_value("sqrt(4)"), 2.0)
+
     def test_pop_column_ckey(self):
         self.databox.load_file(path=self.data_path3)
         val = self.databox.pop_column('x_data')
@@ -237,6 +301,422 @@ class Test_databox(_ut.TestCase):
         expected_value = 85.0
         self.assertEqual(value, expected_value)
 
+    def test_load_file_complex_column(self):
+        """
+        Only the column with i / j entries should come back complex.
+        """
+        path = os.path.join(self.data_folder, 'complex_xyz.dat')
+        d1 = _dt.databox().load_file(path=path)
+        d2 = _dt.databox().load_file(path=path, parser='complex')
+        self.assertEqual(d1[0].dtype, _n.float64)
+        self.assertEqual(d1[2].dtype, _n.complex128)
+        self.assertEqual(d1[2][1], 3-1.5j)
+        for n in range(3): self.assertListEqual(d1[n].tolist(), d2[n].tolist())
+
+    def test_load_file_fast_fallback(self):
+        """
+        Irregular data (missing elements) should still load.
+        """
+        d = _dt.databox()
+        d['a'] = [1.0, 2.0, 3.0]
+        d['b'] = [4.0, 5.0]
+        path = os.path.join(_dt._s.settings.path_home, 'test_fast_fallback.dat')
+        d.save_file(path, force_overwrite=True)
+
+        d = _dt.databox().load_file(path=path)
+        os.remove(path)
+        self.assertListEqual(d[0].tolist(), [1.0, 2.0, 3.0])
+        self.assertTrue(_n.isnan(d[1][2]))
+
+        # ragged lines whose elements happen to add up to rows*columns
+        self.assertRaises(ValueError, _dt._parse_data_text_fast, '1 2 3\n4 5\n6 7 8 9\n')
+        self.assertRaises(ValueError, _dt._parse_data_text_fast, '1,2\n3,,4\n5\n', ',')
+
+    def test_load_file_header_only(self):
+        self.databox.load_file(path=self.data_path3, header_only=True)
+        self.assertEqual(self.databox.h('header2'), 'value2')
+        self.assertEqual(len(self.databox), 0)
+
+    def test_load_file_first_data_line(self):
+        """
+        Lines below a specified first_data_line should not end up in the header.
+        """
+        self.databox.load_file(path=self.data_path3, first_data_line=5)
+        self.assertListEqual(self.databox.hkeys, ['header1', 'header2', 'x_data'])
+        self.assertListEqual(self.databox.ckeys, ['x_data', 'y_data'])
+        self.assertEqual(self.databox[1][3], 2.43)
+
+    def test_save_binary_round_trip(self):
+        """
+        Binary files should load through the usual load() with memory-mapped
+        columns and the same header.
+        """
+        self.databox.load_file(path=self.data_path3)
+        self.databox['z'] = self.databox[0] + 1j*self.databox[1]
+        self.databox.h(gain=3.2)
+
+        path = os.path.join(_dt._s.settings.path_home, 'test_binary.dat')
+        self.databox.save_binary(path, force_overwrite=True)
+        d = sm.data.load(path, quiet=True)
+
+        self.assertListEqual(d.ckeys, self.databox.ckeys)
+        self.assertListEqual(d.hkeys, self.databox.hkeys)
+        self.assertEqual(d.h('gain'), 3.2)
+        self.assertIsInstance(d['x_data'], _n.memmap)
+        for k in d.ckeys: self.assertListEqual(d[k].tolist(), self.databox[k].tolist())
+        d = None
+        os.remove(path)
+
+    def test_iter_chunks(self):
+        chunks = list(sm.data.iter_chunks(self.data_path3, rows=10))
+        self.assertListEqual([len(d[0]) for d in chunks], [10, 10, 10, 4])
+        self.assertEqual(chunks[-1].h('header1'), 'value1')
+        self.assertListEqual(chunks[-1].ckeys, ['x_data', 'y_data'])
+        self.assertEqual(chunks[1][0][0], 135.0)
+
+        chunks = list(sm.data.iter_chunks(self.data_path3, rows=1))
+        self.assertListEqual([len(d[0]) for d in chunks], [1]*34)
+        self.assertEqual(chunks[1][0][0], 90.0)
+
+    def test_load_file_lazy(self):
+        """
+        Lazy loads should only decode the columns that get used.
+        """
+        d = _dt.databox().load_file(path=self.data_path3, lazy=True)
+        self.assertListEqual(d.ckeys, ['x_data', 'y_data'])
+        self.assertEqual(len(d.columns), 2)
+        self.assertListEqual(d.columns._loaded.keys(), [])
+
+        self.assertEqual(d.execute_script("c('y_data')")[3], 2.43)
+        self.assertListEqual(d.columns._loaded.keys(), ['y_data'])
+
+        # copies stay lazy, and dict() sees everything
+        c = d.columns.copy()
+        self.assertListEqual(sorted(c.keys()), ['x_data', 'y_data'])
+        self.assertListEqual(c._loaded.keys(), ['y_data'])
+        self.assertListEqual(sorted(dict(d.columns).keys()), ['x_data', 'y_data'])
+        self.assertEqual(d[0][0], 85.0)
+
+        # renamed columns, and irregular data parsed just once
+        d = _dt.databox()
+        d.obnoxious_ckeys = {'z_data':'zed'}
+        d.load_file(path=os.path.join(self.data_folder, 'complex_xyz.dat'), lazy=True)
+        self.assertEqual(d['zed'][1], 3-1.5j)
+        self.assertIsNone(d.columns._loader.lines)
+        self.assertListEqual(d[0].tolist(), _dt.databox().load_file(path=d.path)[0].tolist())
+
+    def test_save_file_round_trip(self):
+        """
+        Saved ragged and complex columns should load back unchanged.
+        """
+        path = os.path.join(_dt._s.settings.path_home, 'test_save_file.dat')
+        d = _dt.databox()
+        d['x'] = [1.0, 2.5, 3.0]
+        d['z'] = [1+2j, -0.5-1j]
+        d['n'] = [7]
+        d.save_file(path, force_overwrite=True)
+
+        self.assertEqual(open(path).read().split('\n')[-3:], ['2.5\t(-0.5-1j)\t_', '3.0\t_\t_', ''])
+
+        e = _dt.databox().load_file(path)
+        os.remove(path)
+        self.assertListEqual(e['x'].tolist(), [1.0, 2.5, 3.0])
+        self.assertListEqual(e['z'][0:2].tolist(), [1+2j, -0.5-1j])
+        self.assertEqual(e['n'][0], 7)
+
+        # other precisions should be written like str() writes them
+        d = _dt.databox()
+        d['f'] = _n.array([0.1, 2.5], dtype=_n.float32)
+        d['c'] = _n.array([0.1+0.2j, 1j], dtype=_n.complex64)
+        d.save_file(path, force_overwrite=True)
+        lines = open(path).read().split('\n')[-3:]
+        os.remove(path)
+        self.assertEqual(lines, [str(d['f'][0])+'\t'+str(d['c'][0]), '2.5\t'+str(d['c'][1]), ''])
+        self.assertEqual(lines[0], '0.1\t(0.1+0.2j)')
+
+    def test_save_file_compressed(self):
+        """
+        .gz and .bz2 files should be compressed on save and load back the same.
+        """
+        d = _dt.databox(delimiter=',')
+        d.h(gain=2.5)
+        d['x'] = _n.arange(1000)*0.5
+        d['y'] = _n.arange(1000)**2
+
+        for extension in ['.gz', '.bz2']:
+            path = os.path.join(_dt._s.settings.path_home, 'test_save_file.csv'+extension)
+            d.save_file(path, force_overwrite=True, compression_level=1)
+            self.assertNotEqual(open(path, 'rb').read(1), 'g')
+
+            e = _dt.databox().load_file(path)
+            f = _dt.databox().load_file(path, lazy=True)
+            self.assertEqual(e.h('gain'), 2.5)
+            self.assertListEqual(e['x'].tolist(), d['x'].tolist())
+            self.assertListEqual(f['y'].tolist(), d['y'].tolist())
+            os.remove(path)
+
+    def test_save_file_append(self):
+        """
+        append=True should only add the new rows, and fall back to a full
+        save when the columns change.
+        """
+        path = os.path.join(_dt._s.settings.path_home, 'test_save_file_append.dat')
+        d = _dt.databox()
+        d['x'] = [1, 2]; d['y'] = [3, 4]
+        d.save_file(path, force_overwrite=True, append=True)
+        first = open(path).read()
+
+        d.append_data_point([5, 6])
+        d.append_data_point([7, 8])
+        d.save_file(path, append=True, fsync=True)
+        self.assertEqual(open(path).read(), first+'5\t6\n7\t8\n')
+        self.assertListEqual(_dt.databox().load_file(path)['y'].tolist(), [3, 4, 6, 8])
+
+        d['z'] = [0, 0, 0, 0]
+        d.save_file(path, force_overwrite=True, append=True)
+        self.assertListEqual(_dt.databox().load_file(path).ckeys, ['x', 'y', 'z'])
+        os.remove(path)
+
+    def test_save_file_append_ring_and_pop(self):
+        """
+        Ring buffers and popped points should never append the wrong rows.
+        """
+        path = os.path.join(_dt._s.settings.path_home, 'test_save_file_append_ring.dat')
+        d = _dt.databox(max_points=3)
+        d['t'] = [0.0]
+        for i in range(1, 8):
+            d.append_data_point([i])
+            d.save_file(path, force_overwrite=True, append=True)
+        self.assertListEqual(_dt.databox().load_file(path)['t'].tolist(), [5, 6, 7])
+
+        d = _dt.databox()
+        d['t'] = [0.0, 1.0, 2.0]
+        d.save_file(path, force_overwrite=True, append=True)
+        d.pop_data_point(-1)
+        d.append_data_point([5.0])
+        d.save_file(path, force_overwrite=True, append=True)
+        self.assertListEqual(_dt.databox().load_file(path)['t'].tolist(), [0, 1, 5])
+
+        d.append_data_point([6.0])
+        d.save_file(path, append=True)
+        self.assertListEqual(_dt.databox().load_file(path)['t'].tolist(), [0, 1, 5, 6])
+        os.remove(path)
+
+    @_ut.skipIf(_dt._h5py is None, 'needs h5py')
+    def test_save_h5(self):
+        """
+        Several databoxes should share one HDF5 file, and load back whole
+        or a slice at a time.
+        """
+        path = os.path.join(_dt._s.settings.path_home, 'test_save_h5.h5')
+        d = _dt.databox()
+        d.h(gain=2.5, name='sweep')
+        d['x'] = _n.arange(1000)*0.5
+        d['z'] = _n.arange(3)+1j
+        self.assertTrue(d.save_h5(path, 'a', force_overwrite=True))
+        self.assertTrue(d.save_h5(path, 'b', force_overwrite=True))
+        self.assertFalse(d.save_h5(path, 'b'))
+        self.assertListEqual(_dt.h5_groups(path), ['a', 'b'])
+
+        e = _dt.load_h5(path, 'b', quiet=True)
+        self.assertEqual(e.headers, d.headers)
+        self.assertListEqual(e['x'].tolist(), d['x'].tolist())
+        self.assertListEqual(e['z'].tolist(), d['z'].tolist())
+
+        e = _dt.load_h5(path, 'a', rows=slice(10,12), lazy=True, quiet=True)
+        self.assertListEqual(e['x'].tolist(), [5.0, 5.5])
+        os.remove(path)
+
+    def test_concatenate(self):
+        """
+        Rows should stack in order with a source column, conflicting headers
+        should become lists, and mismatched ckeys should be refused.
+        """
+        a = _dt.databox(); a.h(T=4.2, run=1); a['x'] = [1, 2];     a['y'] = [1.5, 2.0]
+        b = _dt.databox(); b.h(T=4.2, run=2); b['y'] = [3, 4, 5]; b['x'] = [3, 4, 5]
+
+        c = _dt.concatenate([a, b], source_column='n')
+        self.assertListEqual(c.ckeys, ['x', 'y', 'n'])
+        self.assertListEqual(c['y'].tolist(), [1.5, 2.0, 3.0, 4.0, 5.0])
+        self.assertListEqual(c['n'].tolist(), [0, 0, 1, 1, 1])
+        self.assertEqual(c.h('T'), 4.2)
+        self.assertEqual(c.h('run'), [1, 2])
+
+        # ragged databoxes keep their rows lined up
+        r = _dt.databox(); r['x'] = [6, 7]; r['y'] = [8]
+        c = _dt.concatenate([r, a], source_column='n')
+        self.assertListEqual(c['x'].tolist(), [6, 7, 1, 2])
+        self.assertEqual(c['y'].dtype, _n.float64)
+        self.assertTrue(_n.isnan(c['y'][1]))
+        self.assertListEqual(c['y'][2:].tolist(), [1.5, 2.0])
+        self.assertListEqual(c['n'].tolist(), [0, 0, 1, 1])
+
+        z = _dt.databox(); z['z'] = [9]
+        self.assertListEqual(_dt.concatenate([a, z], axis='columns').ckeys, ['x', 'y', 'z'])
+        self.assertIsNone(_dt.concatenate([a, z]))
+
+    def test_append_data_point(self):
+        """
+        Appends should write into spare room without touching old arrays.
+        """
+        for storage in ['dict', 'block']:
+            d = _dt.databox(storage=storage)
+            d['x'] = []; d['y'] = []
+            for i in range(20): d.append_data_point([i, 0.5*i])
+            x = d['x']
+
+            d.append_data_point([100, 1.5])
+            self.assertEqual(len(x), 20)
+            self.assertListEqual(d['x'][-2:].tolist(), [19, 100])
+            self.assertEqual(d['y'][-1], 1.5)
+
+            d.insert_data_point([-1, -1], 0)
+            d.append_data_point([7, 7])
+            self.assertListEqual(d['x'][0:2].tolist(), [-1, 0])
+            self.assertEqual(len(d['y']), 23)
+
+    def test_append_data_point_max_points(self):
+        """
+        With max_points set, the columns should hold the most recent points.
+        """
+        d = _dt.databox(max_points=3)
+        d['t'] = [0, 1]; d['y'] = [0.0, 0.5]
+        for i in range(2, 10): d.append_data_point([i, 0.5*i])
+        self.assertListEqual(d['t'].tolist(), [7, 8, 9])
+        self.assertListEqual(d.execute_script('d[1]*2').tolist(), [7.0, 8.0, 9.0])
+        self.assertEqual(len(d[0].base), 6)
+
+        # inserting drops the oldest points too, and appending carries on
+        d.insert_data_point([7.5, 3.75], 1)
+        self.assertListEqual(d['t'].tolist(), [7.5, 8, 9])
+        d.append_data_point([10, 5.0])
+        self.assertListEqual(d['t'].tolist(), [8, 9, 10])
+        self.assertListEqual(d['y'].tolist(), [4.0, 4.5, 5.0])
+
+    def test_block_storage_views(self):
+        """
+        Columns of a block-storage databox should be views of one 2-D array.
+        """
+        d = _dt.databox(storage='block').load_file(path=self.data_path)
+        self.assertIs(d[0].base, d._block.data)
+        self.assertEqual(len(d._block.data), 2)
+        self.assertIs(d.c('y_data').base, d._block.data)
+        self.assertEqual(d[1][3], 2.43)
+
+    def test_block_storage_diverge(self):
+        """
+        A column with a different length is copied out of the block.
+        """
+        d = _dt.databox(storage='block').load_file(path=self.data_path)
+        d['short'] = [1.0, 2.0]
+        self.assertFalse('short' in d._block.rows)
+        self.assertIs(d[0].base, d._block.data)
+        self.assertListEqual(d['short'].tolist(), [1.0, 2.0])
+
+        # popped columns must not be affected by later block writes
+        x = d.pop_column('x_data')
+        d['x2'] = d[0]*0
+        self.assertEqual(x[0], 85.0)
+
+    def test_block_storage_replace(self):
+        """
+        Replacing a block column must not change arrays handed out before.
+        """
+        d = _dt.databox(storage='block').load_file(path=self.data_path)
+        old = d['x_data']
+        for n in range(10): d['x_data'] = d['x_data']*2
+        self.assertEqual(old[0], 85.0)
+        self.assertEqual(d['x_data'][0], 85.0*2**10)
+        self.assertIs(d['x_data'].base, d._block.data)
+        self.assertIs(d[1].base, d._block.data)
+        self.assertEqual(d[1][3], 2.43)
+        self.assertLessEqual(len(d._block.data), 4)
+
+        y = d.pop_column('y_data')
+        d['z'] = d[0]*0
+        self.assertEqual(y[3], 2.43)
+
+    def test_block_storage_trim(self):
+        d1 = _dt.databox()              .load_file(path=self.data_path)
+        d2 = _dt.databox(storage='block').load_file(path=self.data_path)
+        t1 = d1.trim('c(0) > 150', d1[1] < 20.5)
+        t2 = d2.trim('c(0) > 150', d2[1] < 20.5)
+        self.assertListEqual(t1.ckeys, t2.ckeys)
+        self.assertListEqual(t1[1].tolist(), t2[1].tolist())
+        self.assertIs(t2[1].base, t2._block.data)
+
+    def test_load_multiple_workers(self):
+        """
+        Parallel loads should give the same databoxes, in order.
+        """
+        paths = [self.data_path, self.data_path3, self.data_path]
+        d1 = _dt.load_multiple(paths, quiet=True)
+        d2 = _dt.load_multiple(paths, workers=2, quiet=True)
+        self.assertListEqual([d.path for d in d2], paths)
+        for n in range(len(paths)):
+            self.assertListEqual(d1[n].ckeys, d2[n].ckeys)
+            self.assertListEqual(d1[n].hkeys, d2[n].hkeys)
+            self.assertListEqual(d1[n][-1].tolist(), d2[n][-1].tolist())
+
+    def test_load_file_cache(self):
+        """
+        The second cached load should be a memory-mapped copy of the first.
+        """
+        d1 = _dt.databox().load_file(path=self.data_path, cache=True)
+        d2 = _dt.databox().load_file(path=self.data_path, cache=True)
+        cache_path = _dt._cache_path(self.data_path, 'auto', None, 'fast')
+        os.remove(cache_path)
+
+        self.assertIsInstance(d2[0], _n.memmap)
+        self.assertEqual(d2.path, self.data_path)
+        self.assertListEqual(d1.hkeys, d2.hkeys)
+        self.assertListEqual(d1[1].tolist(), d2[1].tolist())
+
+    def test_trim_view(self):
+        """
+        View trims should match copies, sharing memory when contiguous.
+        """
+        d = _dt.databox()
+        d['x'] = _n.arange(10.0)
+        d['y'] = _n.arange(10.0)**2
+
+        t = d.trim('d[0] > 2', 'd[0] < 6', view=True)
+        self.assertListEqual(t['y'].tolist(), d.trim('d[0] > 2', 'd[0] < 6')['y'].tolist())
+        self.assertIs(t['x'].base, d['x'])
+        self.assertFalse(t['x'].flags.writeable)
+
+        t = d.trim('d[1] % 2 == 0', view=True)
+        self.assertListEqual(t['x'].tolist(), [0.0, 2.0, 4.0, 6.0, 8.0])
+
+        # changing the data forgets the masks
+        d['x'] = d['x']+3
+        self.assertListEqual(d.trim('d[0] > 2', 'd[0] < 6')['y'].tolist(), [0.0, 1.0, 4.0])
+
+    def test_trim_globals_changed(self):
+        """
+        Changing the globals a trim script uses should forget its mask.
+        """
+        d = _dt.databox()
+        d.extra_globals = {}
+        d['x'] = _n.arange(10.0)
+
+        d.insert_global(5.0, 'thresh')
+        self.assertListEqual(d.trim('d[0] > thresh')[0].tolist(), [6.0, 7.0, 8.0, 9.0])
+        d.insert_global(8.0, 'thresh')
+        self.assertListEqual(d.trim('d[0] > thresh')[0].tolist(), [9.0])
+
+        d.execute_script('thresh', g=dict(thresh=6.0))
+        self.assertListEqual(d.trim('d[0] > thresh')[0].tolist(), [7.0, 8.0, 9.0])
+        d.extra_globals['thresh'] = 7.0
+        self.assertListEqual(d.trim('d[0] > thresh')[0].tolist(), [8.0, 9.0])
+
+
+def _line(x):
+    """
+    Model helper for the fitter tests (module level so it can be pickled).
+    """
+    return 2*x
+
 
 class Test_fitter(_ut.TestCase):
     """
@@ -298,6 +778,145 @@ class Test_fitter(_ut.TestCase):
         expected_type = list
         self.assertIs(type(value_from_fit), expected_type)
 
+    def test_fit_analytic_jacobian(self):
+        """
+        Fits with the analytic jacobian should agree with finite differences
+        using fewer function evaluations, and fall back for python functions.
+        """
+        x = _n.linspace(0, 10, 200)
+        y = 2.0*x*_n.cos(1.1*x) + 0.5 + 0.01*_n.sin(37*x)
+
+        results = []
+        for jacobian in ['numerical', 'analytic']:
+            f = _dt.fitter('a*x*cos(b*x)+c', 'a=1.8, b=1.05, c', autoplot=False, silent=True, jacobian=jacobian)
+            f.set_data(x, y, 0.01)
+            f.fit()
+            results.append(f.results)
+        self.assertTrue(_n.allclose(results[0][0], results[1][0]))
+        self.assertLess(results[1][2]['nfev'], results[0][2]['nfev'])
+        self.assertIn('njev', results[1][2])
+
+        f = _dt.fitter([lambda x, a: a*x], 'a', autoplot=False, silent=True)
+        self.assertListEqual(f._df, [None])
+
+        # derivatives that blow up where the function doesn't (at x=0)
+        x = _n.linspace(0, 3, 31)
+        for function, pguess, y, expected in [('x**a',        'a=1.5', x**2,          2.0),
+                                              ('b*sqrt(x*b)', 'b=1',   2*_n.sqrt(2*x), 2.0)]:
+            f = _dt.fitter(function, pguess, autoplot=False, silent=True)
+            f.set_data(x, y, 0.01)
+            f.fit()
+            self.assertAlmostEqual(f.results[0][0], expected)
+            self.assertLess(f.reduced_chi_squareds()[0], 1e-6)
+            p, ep, rchi2, failures = f.fit_many(x, [y], 0.01, method='lm')
+            self.assertEqual(failures, {})
+            self.assertTrue(_n.allclose(p[0], f.results[0], rtol=1e-5))
+
+    def test_get_data_cached(self):
+        """
+        The data scripts should only run again when something they use changes.
+        """
+        f = _dt.fitter('a*x+b', 'a, b', autoplot=False, silent=True)
+        f.set_data('linspace(0,1,100)', '2*x[0]+1', 'a*0.1+0*x[0]')
+        for n in range(3): f._massage_data()
+        self.assertEqual(f.counters, dict(scripts=3, get_data=1, massage_data=1))
+
+        f['b'] = 3
+        f.fit()
+        self.assertEqual(f.counters, dict(scripts=3, get_data=1, massage_data=1))
+
+        f['a'] = 2
+        f['xmin'] = 0.5
+        f._massage_data()
+        self.assertEqual(f.counters, dict(scripts=6, get_data=2, massage_data=2))
+        self.assertEqual(len(f._xdata_massaged[0]), 50)
+        self.assertEqual(f['xmax'], [None])
+
+        # several data sets as 2-d arrays
+        x = _n.array([_n.linspace(0, 1, 10), _n.linspace(1, 2, 10)])
+        f = _dt.fitter(['a*x+b', 'a*x-b'], 'a, b', autoplot=False, silent=True)
+        f.set_data(x, _n.array([2*x[0]+1, 2*x[1]-1]), 0.1*_n.ones((2, 10)))
+        f.fit()
+        self.assertTrue(_n.allclose(f.results[0], [2.0, 1.0]))
+
+    def test_fit_many(self):
+        """
+        Batch fits should match single fits, and report failures per fit.
+        """
+        x  = _n.linspace(0, 10, 50)
+        ys = [a*x + 1 + 0.01*_n.sin(7*x) for a in [1.0, 2.0, 3.0, 4.0]]
+        ys[2] = ys[2]*_n.nan
+
+        f = _dt.fitter('a*x+b', 'a, b', autoplot=False, silent=True)
+        p, ep, rchi2, failures = f.fit_many(x, ys, 0.01, chunksize=3)
+        self.assertListEqual(failures.keys(), [2])
+        self.assertTrue(_n.isnan(p[2]).all())
+        self.assertTrue(_n.allclose(p[[0,1,3],0], [1.0, 2.0, 4.0], atol=1e-3))
+
+        f.set_data(x, ys[3], 0.01)
+        f.fit()
+        self.assertTrue(_n.allclose(f.results[0], p[3]))
+        self.assertAlmostEqual(f.reduced_chi_squareds()[0], rchi2[3])
+        self.assertTrue(_n.allclose(_n.sqrt(_n.diag(f.results[1])), ep[3]))
+
+    def test_fit_many_globals(self):
+        """
+        Functions from the globals g should be visible to every fit.
+        """
+        x  = _n.linspace(0, 10, 50)
+        ys = [a*_line(x) + 1 for a in [1.0, 2.0, 3.0]]
+
+        f = _dt.fitter('a*myf(x)+b', 'a, b', g=dict(myf=_line), autoplot=False, silent=True)
+        for workers in [1, 2]:
+            p, ep, rchi2, failures = f.fit_many(x, ys, 0.01, workers=workers, chunksize=1)
+            self.assertEqual(failures, {})
+            self.assertTrue(_n.allclose(p[:,0], [1.0, 2.0, 3.0]))
+
+        # lambdas can't be sent to other processes
+        f = _dt.fitter('a*myf(x)+b', 'a, b', g=dict(myf=lambda x: 2*x), autoplot=False, silent=True)
+        self.assertIsNone(f.fit_many(x, ys, 0.01, workers=2, chunksize=1))
+        self.assertTrue(_n.allclose(f.fit_many(x, ys, 0.01)[0][:,0], [1.0, 2.0, 3.0]))
+
+    def test_fit_many_lm(self):
+        """
+        The vectorized Levenberg-Marquardt should agree with leastsq.
+        """
+        x  = _n.linspace(-5, 5, 100)
+        ys = [1.0/(1+(x-x0)**2/0.25) + 0.01*_n.sin(13*x+x0) for x0 in [-0.2, 0.0, 0.1, 0.3]]
+        ys[1] = ys[1]*_n.inf
+
+        for jacobian in ['analytic', 'numerical']:
+            f = _dt.fitter('A/(1+(x-x0)**2/w**2)+c', 'A=1, x0=0, w=0.4, c=0', autoplot=False, silent=True, jacobian=jacobian)
+            p1, ep1, rchi21, failures1 = f.fit_many(x, ys, 0.01)
+            p2, ep2, rchi22, failures2 = f.fit_many(x, ys, 0.01, method='lm', chunksize=3)
+            self.assertListEqual(failures2.keys(), [1])
+            self.assertTrue(_n.allclose(p1[[0,2,3]], p2[[0,2,3]], atol=1e-6))
+            self.assertTrue(_n.allclose(ep1[[0,2,3]], ep2[[0,2,3]], rtol=1e-3))
+            self.assertTrue(_n.allclose(rchi21[[0,2,3]], rchi22[[0,2,3]]))
+
+        # fits that blow up or never get anywhere are failures, not results
+        x = _n.linspace(0, 10, 20)
+        f = _dt.fitter('exp(a*x)', 'a', autoplot=False, silent=True)
+        p, ep, rchi2, failures = f.fit_many(x, [_n.exp(0.1*x)]*2, 0.1, pguess=[[1000.0], [0.2]], method='lm')
+        self.assertListEqual(failures.keys(), [0])
+        self.assertTrue(_n.isnan(p[0,0]) and _n.isnan(rchi2[0]))
+        self.assertAlmostEqual(p[1,0], 0.1)
+
+    def test_constants(self):
+        """
+        Changing a constant shouldn't rebuild the functions or touch numpy.
+        """
+        f = _dt.fitter('a*x+k', 'a', 'k=2', autoplot=False, silent=True)
+        function = f.f[0]
+        f['k'] = 5
+        self.assertIs(f.f[0], function)
+        self.assertEqual(f.f[0](1.0, 1.0), 6.0)
+        self.assertFalse('k' in _n.__dict__)
+
+        f.set_data([1,2,3], [7,9,11], 0.1)
+        f.fit()
+        self.assertAlmostEqual(f.results[0][0], 2.0)
+
 
 if __name__ == "__main__":
     _ut.main()